@@ -1,13 +1,19 @@
+import asyncio
+import hashlib
+import json
 import os
-from typing import Annotated
+import uuid
+from typing import Annotated, Optional
 
 from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import Runnable
+from langchain_core.runnables import Runnable, RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from langgraph.graph import END, START, StateGraph
 from langgraph.graph.message import AnyMessage, add_messages
-from psycopg.rows import dict_row
+from langgraph.graph.state import CompiledStateGraph
 from psycopg_pool import AsyncConnectionPool
 from typing_extensions import TypedDict
 
@@ -15,109 +21,404 @@ from app.config.config import setup_model
 from app.config.logging import logger
 from app.src.wppconnect.api import send_message
 from app.utils.graph_utils import generate_thread_id, process_chunks, print_graph
+from app.utils.metrics import metrics
+from app.utils.response_cache import (
+    RESPONSE_CACHE_ENABLED,
+    ResponseCache,
+    response_cache,
+)
+from app.utils.retry import RetryPolicy
+from app.utils.streaming import FirstTokenWatcher, stream_reply
+from app.utils.tokens import (
+    count_new_tokens,
+    estimate_tokens,
+    merge_token_counts,
+    message_text,
+    select_context_window,
+    total_tokens,
+)
 from system_prompt import prompt
 
 # Initialize dotenv to load environment variables
 load_dotenv()
 
 
+FALLBACK_REPLY = os.getenv(
+    "LLM_FALLBACK_REPLY",
+    "Sorry, I couldn't put my thoughts into words just now. Could you tell me a bit more?",
+)
+ERROR_REPLY = """Unfortunately, an internal error has occurred in our system. 😕 Please try again later."""
+
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "false").lower() == "true"
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", 4000))
+
+SUMMARY_MAX_MESSAGES = int(os.getenv("SUMMARY_MAX_MESSAGES", 20))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 3000))
+SUMMARY_KEEP_MESSAGES = int(os.getenv("SUMMARY_KEEP_MESSAGES", 6))
+
+SUMMARY_SYSTEM_PROMPT = """You keep a running summary of a conversation between a user and an assistant.
+Preserve what matters to continue the conversation: facts the user shared about themselves,
+their feelings and concerns, and anything that was agreed on. Reply only with the summary."""
+
+
 class State(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
+    summary: str
+    token_counts: Annotated[dict[str, int], merge_token_counts]
 
 
 class Assistant:
-    def __init__(self, runnable: Runnable):
+    def __init__(
+        self,
+        runnable: Runnable,
+        retry_policy: Optional[RetryPolicy] = None,
+        fallback_reply: str = FALLBACK_REPLY,
+        context_budget: int = CONTEXT_MAX_TOKENS,
+        response_cache: Optional[ResponseCache] = None,
+        cache_fingerprint: str = "",
+    ):
         self.runnable = runnable
-
-    def __call__(self, state: State):
-        while True:
-            result = self.runnable.invoke(state)
-            if (
-                not result.content
-                or isinstance(result.content, list)
-                and not result.content[0].get("text")
-            ):
+        self.retry_policy = retry_policy or RetryPolicy.from_env()
+        self.fallback_reply = fallback_reply
+        self.context_budget = context_budget
+        self.response_cache = response_cache
+        self.cache_fingerprint = cache_fingerprint
+
+    async def __call__(self, state: State, config: RunnableConfig):
+        cache_key = self._cache_key(state, config)
+        cached_reply = cache_key and self.response_cache.get(cache_key)
+
+        # Token counts are computed once per message and cached in the state
+        token_counts = state.get("token_counts") or {}
+        new_counts = count_new_tokens(state["messages"], token_counts)
+        window = select_context_window(
+            state["messages"], {**token_counts, **new_counts}, self.context_budget
+        )
+        state = {
+            **state,
+            "messages": window,
+            "summary": render_summary(state.get("summary")),
+        }
+
+        if cached_reply:
+            result = AIMessage(content=cached_reply)
+        else:
+            try:
+                result = await self._generate_within_deadline(state, config)
+            except asyncio.TimeoutError:
+                metrics.increment("llm_turn_deadline_exceeded")
+                logger.warning(
+                    f"LLM turn exceeded the {self.retry_policy.deadline}s deadline"
+                )
+                result = None
+
+            if result is None:
+                metrics.increment("llm_fallback_replies")
+                result = AIMessage(content=self.fallback_reply)
+            elif cache_key:
+                self.response_cache.set(cache_key, message_text(result))
+
+        if result.id is None:
+            result.id = str(uuid.uuid4())
+        new_counts[result.id] = estimate_tokens(result)
+        return {"messages": result, "token_counts": new_counts}
+
+    def _cache_key(self, state: State, config: RunnableConfig) -> Optional[str]:
+        """Cache key of the latest user message, or None when caching doesn't apply."""
+        if self.response_cache is None:
+            return None
+        configurable = config.get("configurable", {})
+        if not configurable.get("response_cache", True):
+            return None
+        if not self.response_cache.is_enabled(configurable.get("thread_id")):
+            return None
+
+        # Only a message opening a conversation gets the same reply for every
+        # sender; later replies depend on the history and would rarely be reused
+        messages = state["messages"]
+        if len(messages) != 1 or state.get("summary"):
+            return None
+        if not isinstance(messages[-1], HumanMessage):
+            return None
+        return self.response_cache.key(
+            message_text(messages[-1]), f"{self.cache_fingerprint}:new"
+        )
+
+    async def _generate_within_deadline(self, state: State, config: RunnableConfig):
+        """
+        Run ``_generate`` under the turn deadline, until the answer starts streaming.
+
+        Streamed sentences may already have been sent, so a generation that got
+        that far is let finish instead of being replaced by the fallback reply.
+
+        Raises:
+            asyncio.TimeoutError: Nothing was streamed before the deadline.
+        """
+        watcher = FirstTokenWatcher()
+        generation = asyncio.ensure_future(self._generate(state, watcher.watch(config)))
+        streamed = asyncio.ensure_future(watcher.streamed.wait())
+        try:
+            await asyncio.wait(
+                {generation, streamed},
+                timeout=self.retry_policy.deadline,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        except BaseException:
+            generation.cancel()
+            raise
+        finally:
+            streamed.cancel()
+        if not generation.done() and not watcher.streamed.is_set():
+            generation.cancel()
+            await asyncio.gather(generation, return_exceptions=True)
+            raise asyncio.TimeoutError
+        return await generation
+
+    async def _generate(self, state: State, config: RunnableConfig):
+        """Invoke the model until it returns content or the attempts run out."""
+        for attempt in range(1, self.retry_policy.max_attempts + 1):
+            result = await self.runnable.ainvoke(state, config)
+            if not is_empty_output(result):
+                return result
+
+            metrics.increment("llm_empty_outputs")
+            logger.warning(
+                f"Empty LLM output (attempt {attempt}/{self.retry_policy.max_attempts})"
+            )
+            if attempt == 1:
                 messages = state["messages"] + [("user", "Respond with a real output.")]
                 state = {**state, "messages": messages}
-            else:
-                break
-        return {"messages": result}
+            if attempt < self.retry_policy.max_attempts:
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+        return None
 
 
-primary_assistant_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", prompt),
-        ("placeholder", "{messages}"),
-    ]
-)
+def is_empty_output(result: AIMessage) -> bool:
+    """Check if the model answered without any text."""
+    return (
+        not result.content
+        or isinstance(result.content, list)
+        and not result.content[0].get("text")
+    )
 
+
+class Summarizer:
+    """Fold the oldest turns into a running summary to bound the history size."""
+
+    def __init__(self, runnable: Runnable, keep_messages: int = SUMMARY_KEEP_MESSAGES):
+        self.runnable = runnable
+        self.keep_messages = keep_messages
+
+    async def __call__(self, state: State, config: RunnableConfig) -> Optional[dict]:
+        """Return the state update, or None to leave the history as it is."""
+        messages = state["messages"]
+
+        # Keep the most recent messages, starting the kept window on a user turn
+        split = max(len(messages) - self.keep_messages, 0)
+        while split < len(messages) and not isinstance(messages[split], HumanMessage):
+            split += 1
+        old_messages = messages[:split]
+        if not old_messages:
+            return None
+
+        try:
+            result = await self.runnable.ainvoke(
+                {"messages": old_messages, "summary": state.get("summary") or "None"},
+                config,
+            )
+        except Exception as e:
+            # Summarization is best effort, the reply has already been produced
+            logger.error(f"Error summarizing conversation: {e}")
+            return None
+
+        if is_empty_output(result):
+            return None
+
+        logger.info(f"Summarized {len(old_messages)} messages")
+        return {
+            "summary": message_text(result),
+            "messages": [RemoveMessage(id=message.id) for message in old_messages],
+            "token_counts": {message.id: None for message in old_messages},
+        }
+
+
+def should_summarize(state: State) -> str:
+    """Route to the summarizer once the history crosses the size thresholds."""
+    messages = state["messages"]
+    token_counts = state.get("token_counts") or {}
+    if (
+        len(messages) > SUMMARY_MAX_MESSAGES
+        or total_tokens(messages, token_counts) > SUMMARY_MAX_TOKENS
+    ):
+        return "summarize"
+    return END
+
+
+def render_summary(summary: Optional[str]) -> str:
+    """Format the running summary so it can be appended to the system prompt."""
+    if not summary:
+        return ""
+    return f"\n\nSummary of the conversation so far:\n{summary}"
+
+
+# Providers are tried from the fastest healthy one; unavailable ones are skipped
 llm_config = {
-    "provider": "groq",
-    "model": "llama-3.3-70b-specdec",
     "temperature": 0.6,
+    "providers": [
+        {"provider": "groq", "model": "llama-3.3-70b-specdec"},
+        {"provider": "google", "model": "gemini-2.0-flash"},
+        {"provider": "openai", "model": "gpt-4o-mini"},
+    ],
 }
 
-llm_model = setup_model(llm_config)
-
-
-assistant_runnable = primary_assistant_prompt | llm_model
-
 
-builder = StateGraph(State)
-
-
-# Define nodes: these do the work
-builder.add_node("assistant", Assistant(assistant_runnable))
-
-# Define edges: these determine how the control flow moves
-builder.add_edge(START, "assistant")
-builder.add_edge("assistant", END)
+def create_builder(llm_config: dict, system_prompt: str) -> StateGraph:
+    """Build the (uncompiled) agent graph for a model configuration and prompt."""
+    primary_assistant_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", "{system_prompt}{summary}"),
+            ("placeholder", "{messages}"),
+        ]
+    ).partial(system_prompt=system_prompt)
+
+    summary_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", SUMMARY_SYSTEM_PROMPT),
+            ("placeholder", "{messages}"),
+            (
+                "user",
+                "Current summary:\n{summary}\n\n"
+                "Extend the summary with the conversation above.",
+            ),
+        ]
+    )
+
+    llm_model = setup_model(llm_config)
+
+    assistant_runnable = primary_assistant_prompt | llm_model
+    summary_runnable = summary_prompt | llm_model
+
+    builder = StateGraph(State)
+
+    # Define nodes: these do the work
+    builder.add_node(
+        "assistant",
+        Assistant(
+            assistant_runnable,
+            response_cache=response_cache if RESPONSE_CACHE_ENABLED else None,
+            cache_fingerprint=config_fingerprint(llm_config, system_prompt),
+        ),
+    )
+    builder.add_node("summarize", Summarizer(summary_runnable))
+
+    # Define edges: these determine how the control flow moves
+    builder.add_edge(START, "assistant")
+    builder.add_conditional_edges("assistant", should_summarize, ["summarize", END])
+    builder.add_edge("summarize", END)
+
+    return builder
+
+
+def config_fingerprint(llm_config: dict, system_prompt: str) -> str:
+    """Short hash identifying a model configuration and prompt."""
+    data = json.dumps(llm_config, sort_keys=True) + system_prompt
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:12]
+
+
+class GraphCache:
+    """
+    Compiled graphs shared by every turn.
+
+    The graph topology never changes between messages, so it is compiled once
+    per checkpointer and agent configuration and reused by all concurrent turns.
+    Call ``rebuild`` after changing the prompt or the model configuration.
+    """
+
+    def __init__(self, llm_config: dict, system_prompt: str):
+        self.llm_config = llm_config
+        self.system_prompt = system_prompt
+        self._builder = None
+        self._graphs = {}
+
+    def _config_key(self) -> tuple:
+        return (json.dumps(self.llm_config, sort_keys=True), self.system_prompt)
+
+    def get(self, checkpointer: BaseCheckpointSaver) -> CompiledStateGraph:
+        """Return the compiled graph for ``checkpointer``, compiling it on first use."""
+        key = (checkpointer, self._config_key())
+        graph = self._graphs.get(key)
+        if graph is None:
+            if self._builder is None:
+                self._builder = create_builder(self.llm_config, self.system_prompt)
+            graph = self._builder.compile(checkpointer=checkpointer)
+            self._graphs[key] = graph
+            logger.info(f"Compiled agent graph for {type(checkpointer).__name__}")
+        return graph
+
+    def rebuild(
+        self, llm_config: Optional[dict] = None, system_prompt: Optional[str] = None
+    ) -> None:
+        """Apply a new model configuration and/or prompt and drop compiled graphs."""
+        if llm_config is not None:
+            self.llm_config = llm_config
+        if system_prompt is not None:
+            self.system_prompt = system_prompt
+        self._builder = None
+        self._graphs.clear()
+        logger.info("Agent graph cache cleared, graphs will be recompiled")
+
+
+graph_cache = GraphCache(llm_config, prompt)
 
 
 ## TO PRINT THE GRAPH
 # from langgraph.checkpoint.memory import MemorySaver
 
 # checkpoint = MemorySaver()
-# graph = builder.compile(checkpointer=checkpoint)
+# graph = graph_cache.get(checkpoint)
 
 # print_graph(graph)
 
 
-async def main(phone_number, message):
-    try:
-        async with AsyncConnectionPool(
-            conninfo=os.getenv("PSQL_CONNECTION_STRING"),
-            max_size=20,
-            kwargs={
-                "autocommit": True,
-                "prepare_threshold": 0,
-                "row_factory": dict_row,
-            },
-        ) as pool, pool.connection() as conn:
-            checkpointer = AsyncPostgresSaver(conn)
+def create_checkpointer(pool: AsyncConnectionPool) -> AsyncPostgresSaver:
+    """Create the checkpointer shared by every turn on top of the connection pool."""
+    return AsyncPostgresSaver(pool)
 
-            # await checkpointer.setup() # FIRST EXECUTION ONLY
 
-            graph = builder.compile(checkpointer=checkpointer)
+async def main(
+    phone_number, message, checkpointer: AsyncPostgresSaver, text_only: bool = False
+):
+    try:
+        # await checkpointer.setup() # FIRST EXECUTION ONLY
 
+        graph = graph_cache.get(checkpointer)
 
-            thread_id = generate_thread_id(phone_number)
+        thread_id = generate_thread_id(phone_number)
 
-            config = {
-                "configurable": {},
-            }
+        config = {
+            "configurable": {},
+        }
 
-            config["configurable"]["thread_id"] = thread_id
-            config["configurable"]["phone_number"] = phone_number
+        config["configurable"]["thread_id"] = thread_id
+        config["configurable"]["phone_number"] = phone_number
 
-            logger.info(f"Thread ID: {thread_id}")
+        logger.info(f"Thread ID: {thread_id}")
 
-            input_data = {"messages": [{"role": "user", "content": message}]}
+        input_data = {"messages": [{"role": "user", "content": message}]}
 
+        if STREAM_REPLIES:
+            await stream_reply(graph, input_data, config, phone_number, text_only)
+        else:
             async for chunk in graph.astream(
                 input=input_data, config=config, stream_mode="updates"
             ):
-                process_chunks(chunk, phone_number)
-    except:
-        custom_message = """Unfortunately, an internal error has occurred in our system. 😕 Please try again later."""
-        send_message(custom_message, phone_number)
\ No newline at end of file
+                # TTS and the WPPConnect upload are blocking, keep them off the event loop
+                await asyncio.to_thread(
+                    process_chunks, chunk, phone_number, text_only
+                )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Error running agent turn for {phone_number}: {e}")
+        await asyncio.to_thread(send_message, ERROR_REPLY, phone_number)
\ No newline at end of file
@@ -1,17 +1,19 @@
 import os
+from typing import Callable, Dict, Iterable
 
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.language_models import BaseChatModel
 
+from app.config.logging import logger
+from app.config.router import ModelRouter
 
-def load_environment():
+
+def load_environment(required: Iterable[str] = ("GOOGLE_API_KEY",)):
     """Load and validate environment variables."""
     load_dotenv()
 
     # Required environment variables
-    required_vars = {
-        "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY"),
-    }
+    required_vars = {name: os.getenv(name) for name in required}
 
     # Check for missing variables
     missing = [k for k, v in required_vars.items() if not v]
@@ -21,14 +23,92 @@ def load_environment():
     return required_vars
 
 
+def _create_groq(llm_config: dict) -> BaseChatModel:
+    from langchain_groq import ChatGroq
+
+    env = load_environment(["GROQ_API_KEY"])
+    return ChatGroq(
+        model=llm_config["model"],
+        temperature=llm_config["temperature"],
+        api_key=env["GROQ_API_KEY"],
+    )
+
+
+def _create_google(llm_config: dict) -> BaseChatModel:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    env = load_environment(["GOOGLE_API_KEY"])
+    return ChatGoogleGenerativeAI(
+        model=llm_config["model"],
+        temperature=llm_config["temperature"],
+        google_api_key=env["GOOGLE_API_KEY"],
+    )
+
+
+def _create_openai(llm_config: dict) -> BaseChatModel:
+    """Any OpenAI-compatible endpoint (OpenAI, vLLM, Ollama, Together...)."""
+    from langchain_openai import ChatOpenAI
+
+    env = load_environment(["OPENAI_API_KEY"])
+    return ChatOpenAI(
+        model=llm_config["model"],
+        temperature=llm_config["temperature"],
+        api_key=env["OPENAI_API_KEY"],
+        base_url=llm_config.get("base_url") or os.getenv("OPENAI_BASE_URL"),
+    )
+
+
+def _create_stub(llm_config: dict) -> BaseChatModel:
+    """Offline model that answers with canned responses, for local tests."""
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    return FakeListChatModel(
+        responses=llm_config.get("responses", ["Hello! How can I help you today?"]),
+        sleep=llm_config.get("sleep"),
+    )
+
+
+PROVIDERS: Dict[str, Callable[[dict], BaseChatModel]] = {
+    "groq": _create_groq,
+    "google": _create_google,
+    "openai": _create_openai,
+    "stub": _create_stub,
+}
+
+
+def register_provider(name: str, factory: Callable[[dict], BaseChatModel]) -> None:
+    """Register a chat model factory under a provider name."""
+    PROVIDERS[name] = factory
+
+
+def create_model(llm_config: dict) -> BaseChatModel:
+    """Initialize the chat model of a single provider."""
+    provider = llm_config["provider"]
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider: {provider}")
+    return PROVIDERS[provider](llm_config)
+
+
 def setup_model(llm_config):
-    """Initialize all required services."""
-    # Load environment variables
-    env = load_environment()
-
-    if llm_config["provider"] == "google":
-        return ChatGoogleGenerativeAI(
-            model=llm_config["model"],
-            temperature=llm_config["temperature"],
-            google_api_key=env["GOOGLE_API_KEY"]
-        )
+    """
+    Initialize the chat model used by the agent.
+
+    A config with a ``providers`` list builds a ModelRouter in front of every
+    provider that can be initialized; otherwise a single model is returned.
+    """
+    if "providers" not in llm_config:
+        return create_model(llm_config)
+
+    defaults = {k: v for k, v in llm_config.items() if k != "providers"}
+    models = {}
+    for provider_config in llm_config["providers"]:
+        provider_config = {**defaults, **provider_config}
+        name = f"{provider_config['provider']}:{provider_config['model']}"
+        try:
+            models[name] = create_model(provider_config)
+        except (ImportError, ValueError) as e:
+            logger.warning(f"LLM provider {name} unavailable: {e}")
+
+    if not models:
+        raise ValueError("No LLM provider could be initialized")
+    return ModelRouter(models)
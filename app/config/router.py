@@ -0,0 +1,146 @@
+import os
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from app.config.logging import logger
+from app.utils.metrics import metrics
+from app.utils.streaming import FirstTokenWatcher
+
+load_dotenv()
+
+ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", 20))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", 0.5))
+ROUTER_COOLDOWN = float(os.getenv("LLM_ROUTER_COOLDOWN", 30))
+
+
+class ProviderStats:
+    """Rolling latency and error rate of a provider over its last calls."""
+
+    def __init__(self, window: int = ROUTER_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.unhealthy_until = 0.0
+
+    @property
+    def latency(self) -> float:
+        """Mean latency in seconds of the recent successful calls."""
+        if not self.latencies:
+            return 0.0
+        return sum(self.latencies) / len(self.latencies)
+
+    @property
+    def sampled(self) -> bool:
+        """True once a call succeeded, so ``latency`` means something."""
+        return bool(self.latencies)
+
+    @property
+    def error_rate(self) -> float:
+        """Fraction of the recent calls that failed."""
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def is_healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def record_success(self, latency: float) -> None:
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+
+    def record_failure(self, max_error_rate: float, cooldown: float) -> None:
+        self.outcomes.append(False)
+        # Wait for a few samples before taking the provider out of rotation
+        if len(self.outcomes) >= 3 and self.error_rate >= max_error_rate:
+            self.unhealthy_until = time.monotonic() + cooldown
+
+
+class ModelRouter(Runnable):
+    """
+    Route chat model calls to the fastest healthy provider.
+
+    Providers are tried from the lowest rolling latency to the highest, then
+    the ones without a successful call yet, in configuration order. A provider
+    whose error rate reaches ``max_error_rate`` is moved to the back of the
+    list for ``cooldown`` seconds, and a failed call fails over to the next
+    provider, unless it had already streamed tokens: they may have been
+    sent to the user, so the error is raised instead of starting over.
+    """
+
+    def __init__(
+        self,
+        models: Dict[str, BaseChatModel],
+        max_error_rate: float = ROUTER_MAX_ERROR_RATE,
+        cooldown: float = ROUTER_COOLDOWN,
+    ):
+        self.models = models
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.stats = {name: ProviderStats() for name in models}
+        for name, stats in self.stats.items():
+            metrics.register_gauge(
+                f"llm_provider_latency.{name}", lambda stats=stats: stats.latency
+            )
+            metrics.register_gauge(
+                f"llm_provider_error_rate.{name}", lambda stats=stats: stats.error_rate
+            )
+
+    def ranked_providers(self) -> List[str]:
+        """Provider names in the order they will be tried."""
+        order = list(self.models)
+        return sorted(
+            order,
+            key=lambda name: (
+                not self.stats[name].is_healthy(),
+                # An unsampled provider reports 0.0, don't let it jump the queue
+                not self.stats[name].sampled,
+                self.stats[name].latency,
+                order.index(name),
+            ),
+        )
+
+    def _record_failure(self, name: str, error: Exception) -> None:
+        self.stats[name].record_failure(self.max_error_rate, self.cooldown)
+        metrics.increment(f"llm_provider_errors.{name}")
+        logger.warning(f"LLM provider {name} failed: {error}")
+
+    def invoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        error = None
+        for name in self.ranked_providers():
+            start = time.monotonic()
+            try:
+                result = self.models[name].invoke(input, config, **kwargs)
+            except Exception as e:
+                self._record_failure(name, e)
+                error = e
+                continue
+            self.stats[name].record_success(time.monotonic() - start)
+            return result
+        raise error
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        error = None
+        for name in self.ranked_providers():
+            start = time.monotonic()
+            watcher = FirstTokenWatcher()
+            try:
+                result = await self.models[name].ainvoke(
+                    input, watcher.watch(config), **kwargs
+                )
+            except Exception as e:
+                self._record_failure(name, e)
+                if watcher.streamed.is_set():
+                    raise
+                error = e
+                continue
+            self.stats[name].record_success(time.monotonic() - start)
+            return result
+        raise error
@@ -0,0 +1,235 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.config.logging import logger
+from app.messaging.senders import SenderTable
+from app.utils.metrics import metrics
+
+load_dotenv()
+
+AGENT_MAX_CONCURRENT_TURNS = int(os.getenv("AGENT_MAX_CONCURRENT_TURNS", 16))
+AGENT_MAX_PENDING_TURNS = int(os.getenv("AGENT_MAX_PENDING_TURNS", 100))
+AGENT_QUEUE_TIMEOUT = float(os.getenv("AGENT_QUEUE_TIMEOUT", 60))
+AGENT_OVERLOAD_POLICY = os.getenv("AGENT_OVERLOAD_POLICY", "queue")
+AGENT_SHED_REPLY = os.getenv(
+    "AGENT_SHED_REPLY",
+    "We're receiving a lot of messages right now. 🙏 Please send your message again in a few minutes.",
+)
+AGENT_PRIORITY_WEIGHTS = os.getenv("AGENT_PRIORITY_WEIGHTS", "text:6,voice:2,long:1")
+AGENT_LONG_TURN_SECONDS = float(os.getenv("AGENT_LONG_TURN_SECONDS", 20))
+AGENT_FAIRNESS_HALF_LIFE = float(os.getenv("AGENT_FAIRNESS_HALF_LIFE", 60))
+AGENT_FAIRNESS_MAX_SENDERS = int(os.getenv("AGENT_FAIRNESS_MAX_SENDERS", 100000))
+
+OVERLOAD_POLICIES = ("queue", "shed", "degrade")
+
+
+def parse_weights(weights: str) -> Dict[str, float]:
+    """Parse ``"text:6,voice:2,long:1"`` into ``{"text": 6.0, ...}``."""
+    parsed = {}
+    for item in weights.split(","):
+        name, _, weight = item.partition(":")
+        parsed[name.strip()] = float(weight)
+    return parsed
+
+
+class TurnShedError(Exception):
+    """The turn was rejected because the agent is overloaded."""
+
+
+class SenderUsage:
+    """Recent agent time used by a sender, decaying with a half-life."""
+
+    __slots__ = ("seconds", "updated_at", "turn_seconds")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.updated_at = time.monotonic()
+        # EWMA of the sender's turn duration
+        self.turn_seconds = 0.0
+
+    def decayed(self, half_life: float, now: float) -> float:
+        return self.seconds * math.pow(0.5, (now - self.updated_at) / half_life)
+
+
+class AdmissionController:
+    """
+    Limit how many agent turns run at once across every conversation.
+
+    When all ``max_concurrent`` slots are busy, the overload policy decides:
+
+    - ``queue``: wait for a slot in a queue of at most ``max_pending`` turns.
+    - ``shed``: reject the turn right away.
+    - ``degrade``: wait like ``queue`` but answer with text only (no TTS), so
+      the backlog drains faster.
+
+    A turn is also rejected when the queue is full or it waited more than
+    ``queue_timeout`` seconds.
+
+    Waiting turns are scheduled by priority class (``text``, ``voice``, and
+    ``long`` for senders whose turns usually take more than ``long_turn``
+    seconds): freed slots go to the classes in proportion to ``weights``
+    (stride scheduling), so a burst of slow turns can't starve quick ones.
+    Within a class, senders who used the least agent time recently (decaying
+    with ``half_life``) go first.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = AGENT_MAX_CONCURRENT_TURNS,
+        max_pending: int = AGENT_MAX_PENDING_TURNS,
+        policy: str = AGENT_OVERLOAD_POLICY,
+        queue_timeout: float = AGENT_QUEUE_TIMEOUT,
+        weights: str = AGENT_PRIORITY_WEIGHTS,
+        long_turn: float = AGENT_LONG_TURN_SECONDS,
+        half_life: float = AGENT_FAIRNESS_HALF_LIFE,
+        max_senders: int = AGENT_FAIRNESS_MAX_SENDERS,
+    ):
+        if policy not in OVERLOAD_POLICIES:
+            raise ValueError(f"Unknown overload policy: {policy}")
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.policy = policy
+        self.queue_timeout = queue_timeout
+        self.weights = parse_weights(weights)
+        self.long_turn = long_turn
+        self.half_life = half_life
+        self._usage = SenderTable("scheduler", max_senders, half_life * 10)
+        self._running = 0
+        self._queued = 0
+        self._sequence = itertools.count()
+        # Per class: heap of (sender usage, arrival, future), and stride pass
+        self._waiting: Dict[str, List[Tuple[float, int, asyncio.Future]]] = {
+            kind: [] for kind in self.weights
+        }
+        self._pass: Dict[str, float] = {kind: 0.0 for kind in self.weights}
+        self._virtual_time = 0.0
+        metrics.register_gauge("agent_turns_running", lambda: self._running)
+        metrics.register_gauge("agent_turns_queued", lambda: self._queued)
+        for kind in self.weights:
+            metrics.register_gauge(
+                f"agent_turns_queued.{kind}",
+                lambda kind=kind: sum(
+                    not future.done() for _, _, future in self._waiting[kind]
+                ),
+            )
+
+    def classify(self, sender_id: Optional[str], kind: str) -> str:
+        """Return the priority class of a turn, ``long`` for usually slow senders."""
+        usage = self._usage.get(sender_id) if sender_id else None
+        if usage and usage.turn_seconds > self.long_turn and "long" in self.weights:
+            return "long"
+        return kind if kind in self.weights else next(iter(self.weights))
+
+    def _shed(self, reason: str) -> None:
+        metrics.increment("agent_turns_shed")
+        logger.warning(f"Shedding agent turn: {reason}")
+        raise TurnShedError(reason)
+
+    def _priority(self, sender_id: Optional[str]) -> float:
+        usage = self._usage.get(sender_id) if sender_id else None
+        return usage.decayed(self.half_life, time.monotonic()) if usage else 0.0
+
+    def _record(self, sender_id: Optional[str], seconds: float) -> None:
+        if not sender_id:
+            return
+        usage = self._usage.get(sender_id) or SenderUsage()
+        now = time.monotonic()
+        usage.seconds = usage.decayed(self.half_life, now) + seconds
+        usage.updated_at = now
+        if usage.turn_seconds:
+            usage.turn_seconds = 0.7 * usage.turn_seconds + 0.3 * seconds
+        else:
+            usage.turn_seconds = seconds
+        self._usage.set(sender_id, usage)
+
+    async def _wait_for_slot(self, sender_id: Optional[str], kind: str) -> None:
+        waiting = self._waiting[kind]
+        if not any(not future.done() for _, _, future in waiting):
+            # An idle class restarts at the current virtual time, not with credit
+            self._pass[kind] = max(self._pass[kind], self._virtual_time)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            waiting, (self._priority(sender_id), next(self._sequence), future)
+        )
+
+        self._queued += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._shed(f"waited more than {self.queue_timeout}s")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before the cancellation
+                self._release()
+            raise
+        finally:
+            self._queued -= 1
+        metrics.observe("agent_turn_queue_wait", time.monotonic() - start)
+        metrics.observe(f"agent_turn_queue_wait.{kind}", time.monotonic() - start)
+
+    def _release(self) -> None:
+        """Hand the slot to the next waiting turn, or free it."""
+        while True:
+            candidates = []
+            for kind, waiting in self._waiting.items():
+                while waiting and waiting[0][2].done():
+                    heapq.heappop(waiting)
+                if waiting:
+                    candidates.append(kind)
+            if not candidates:
+                self._running -= 1
+                return
+
+            kind = min(candidates, key=lambda kind: self._pass[kind])
+            self._virtual_time = self._pass[kind]
+            self._pass[kind] += 1 / self.weights[kind]
+            _, _, future = heapq.heappop(self._waiting[kind])
+            if not future.done():
+                future.set_result(None)
+                return
+
+    async def run(
+        self,
+        turn: Callable[[bool], Awaitable],
+        sender_id: Optional[str] = None,
+        kind: str = "text",
+    ):
+        """
+        Run ``turn`` once a slot is free.
+
+        ``turn`` receives ``text_only``, True when the turn must skip voice replies.
+        ``kind`` is the turn's class before history is taken into account
+        (``text`` or ``voice``).
+
+        Raises:
+            TurnShedError: If the overload policy rejected the turn.
+        """
+        kind = self.classify(sender_id, kind)
+        text_only = False
+        if self._running >= self.max_concurrent:
+            if self.policy == "shed":
+                self._shed(f"{self._running} turns running")
+            if self._queued >= self.max_pending:
+                self._shed(f"{self._queued} turns queued")
+            text_only = self.policy == "degrade"
+            # The slot is handed over by _release, already counted as running
+            await self._wait_for_slot(sender_id, kind)
+        else:
+            self._running += 1
+
+        if text_only:
+            metrics.increment("agent_turns_degraded")
+        start = time.monotonic()
+        try:
+            return await turn(text_only)
+        finally:
+            self._record(sender_id, time.monotonic() - start)
+            self._release()
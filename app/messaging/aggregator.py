@@ -0,0 +1,233 @@
+import asyncio
+import os
+import re
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.config.logging import logger
+from app.messaging.cadence import AGGREGATION_ADAPTIVE, CadenceModel
+from app.messaging.store import (
+    AggregationStore,
+    AggregationWindow,
+    Entry,
+    Flushed,
+    MemoryAggregationStore,
+)
+from app.utils.metrics import metrics
+
+load_dotenv()
+
+WAIT_TIME = float(os.getenv("WAIT_TIME", 1))
+AGGREGATION_MODE = os.getenv("AGGREGATION_MODE", "debounce")
+AGGREGATION_MAX_WAIT = float(os.getenv("AGGREGATION_MAX_WAIT", 10))
+AGGREGATION_FLUSH_PATTERN = os.getenv("AGGREGATION_FLUSH_PATTERN", r"\?\s*$")
+AGGREGATION_POLL_INTERVAL = float(os.getenv("AGGREGATION_POLL_INTERVAL", 0.5))
+AGGREGATION_LEASE = float(os.getenv("AGGREGATION_LEASE", 15))
+
+FlushCallback = Callable[[str, List[Entry], dict], Awaitable]
+
+
+class MessageAggregator:
+    """
+    Aggregate the messages of a sender before handing them to the agent.
+
+    In ``fixed`` mode the window closes ``wait_time`` seconds after the first
+    message. In ``debounce`` mode every new message extends the window by
+    ``wait_time`` seconds, up to ``max_wait`` seconds after the first one, and
+    a message matching ``flush_pattern`` (e.g. ending with "?") closes it at once.
+    With ``adaptive``, the debounce delay is learned per sender from their
+    typing cadence instead of being ``wait_time`` for everyone (see CadenceModel).
+
+    Buffers live in an AggregationStore. The process that opens a window owns
+    it and runs its timer; with a shared store the other workers only append,
+    and the owner polls the store every ``poll_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        on_flush: FlushCallback,
+        store: Optional[AggregationStore] = None,
+        wait_time: float = WAIT_TIME,
+        mode: str = AGGREGATION_MODE,
+        max_wait: float = AGGREGATION_MAX_WAIT,
+        flush_pattern: str = AGGREGATION_FLUSH_PATTERN,
+        poll_interval: float = AGGREGATION_POLL_INTERVAL,
+        lease: float = AGGREGATION_LEASE,
+        adaptive: bool = AGGREGATION_ADAPTIVE,
+    ):
+        if mode not in ("fixed", "debounce"):
+            raise ValueError(f"Unknown aggregation mode: {mode}")
+        self.on_flush = on_flush
+        self.store = store if store is not None else MemoryAggregationStore()
+        self.wait_time = wait_time
+        self.mode = mode
+        self.max_wait = max(max_wait, wait_time)
+        self.flush_pattern = re.compile(flush_pattern) if flush_pattern else None
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.cadence = (
+            CadenceModel(wait_time, self.max_wait)
+            if adaptive and mode == "debounce"
+            else None
+        )
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        # Windows closed and being handed to on_flush (e.g. waiting for voice
+        # notes), by window task, in the order they closed
+        self._flushing: Dict[asyncio.Task, Tuple[str, Flushed]] = {}
+        self._draining = False
+        metrics.register_gauge("aggregation_windows_owned", lambda: len(self._tasks))
+
+    async def add(self, sender_id: str, message: Entry, **context) -> bool:
+        """
+        Add a message to the sender's window, opening one if needed.
+
+        Returns:
+            bool: True if the message opened a new aggregation window.
+        """
+        text = message.get("text") or ""
+        flush_now = bool(
+            self.mode == "debounce"
+            and self.flush_pattern
+            and self.flush_pattern.search(text)
+        )
+        gap = self.cadence.observe(sender_id, time.time()) if self.cadence else None
+        claimed = await self.store.append(
+            sender_id,
+            message,
+            context,
+            self.owner_id,
+            time.time() + self.lease,
+            flush_now,
+        )
+        if claimed:
+            if gap is not None and gap < self.max_wait:
+                # The previous window closed while the sender was still typing
+                metrics.increment("aggregation_windows_split")
+            self._start_window(sender_id)
+        elif sender_id in self._wakeups:
+            self._wakeups[sender_id].set()
+        return claimed
+
+    async def flush_all(self, timeout: float) -> Dict[str, Flushed]:
+        """
+        Close every window owned by this process now and wait up to ``timeout``
+        seconds for them to flush, then cancel the rest.
+
+        Returns:
+            dict: The messages of the windows that were not handed over, by sender.
+        """
+        self._draining = True
+        tasks = list(self._flushing) + list(self._tasks.values())
+        for wake in self._wakeups.values():
+            wake.set()
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        unflushed: Dict[str, Flushed] = {}
+        for sender_id, (messages, context) in self._flushing.values():
+            entries, sender_context = unflushed.setdefault(sender_id, ([], {}))
+            entries.extend(messages)
+            sender_context.update(context)
+        self._flushing.clear()
+        return unflushed
+
+    async def requeue(
+        self, sender_id: str, messages: List[Entry], context: dict
+    ) -> None:
+        """
+        Put back the messages of an unfinished turn as an expired window, so
+        another worker sharing the store takes it over and answers it.
+        """
+        for message in messages:
+            await self.store.append(
+                sender_id, message, context, self.owner_id, 0, flush_now=True
+            )
+
+    async def claim_expired(self) -> None:
+        """Take over the windows left behind by workers that stopped renewing them."""
+        for sender_id in await self.store.claim_expired(
+            self.owner_id, time.time() + self.lease
+        ):
+            logger.info(f"Took over the aggregation window of {sender_id}")
+            self._start_window(sender_id)
+
+    async def watch_expired(self) -> None:
+        """Periodically take over expired windows, until the task is cancelled."""
+        while True:
+            await asyncio.sleep(self.lease)
+            try:
+                await self.claim_expired()
+            except Exception as e:
+                logger.error(f"Error claiming expired aggregation windows: {e}")
+
+    def _start_window(self, sender_id: str) -> None:
+        self._wakeups[sender_id] = asyncio.Event()
+        self._tasks[sender_id] = asyncio.create_task(self._run_window(sender_id))
+
+    def _deadline(self, sender_id: str, window: AggregationWindow) -> float:
+        if self.mode == "fixed":
+            return window.opened_at + self.wait_time
+        wait_time = (
+            self.cadence.wait_time(sender_id) if self.cadence else self.wait_time
+        )
+        return min(
+            window.last_message_at + wait_time,
+            window.opened_at + self.max_wait,
+        )
+
+    async def _run_window(self, sender_id: str) -> None:
+        """Wait for the window to close, then flush the buffered messages."""
+        task = asyncio.current_task()
+        wake = self._wakeups[sender_id]
+        try:
+            while True:
+                window = await self.store.renew(
+                    sender_id, self.owner_id, time.time() + self.lease
+                )
+                if window is None:
+                    # Another worker took the window over
+                    return
+                timeout = self._deadline(sender_id, window) - time.time()
+                if window.flush_now or timeout <= 0 or self._draining:
+                    break
+                wake.clear()
+                try:
+                    await asyncio.wait_for(
+                        wake.wait(), min(timeout, self.poll_interval)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+            # Messages arriving from now on open a new window
+            flushed = await self.store.close(sender_id, self.owner_id)
+        finally:
+            if self._tasks.get(sender_id) is task:
+                del self._tasks[sender_id]
+                del self._wakeups[sender_id]
+
+        if flushed is None:
+            return
+        messages, context = flushed
+        waited = time.time() - window.opened_at
+        logger.info(
+            f"Flushing {len(messages)} messages for {sender_id} after {waited:.2f}s"
+        )
+        self._flushing[task] = (sender_id, flushed)
+        try:
+            await self.on_flush(sender_id, messages, context)
+        except asyncio.CancelledError:
+            # Not handed over, flush_all reports the messages as unflushed
+            raise
+        except Exception:
+            del self._flushing[task]
+            raise
+        del self._flushing[task]
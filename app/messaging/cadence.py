@@ -0,0 +1,92 @@
+import math
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from app.messaging.senders import SenderTable
+from app.utils.metrics import metrics
+
+load_dotenv()
+
+AGGREGATION_ADAPTIVE = os.getenv("AGGREGATION_ADAPTIVE", "false").lower() == "true"
+AGGREGATION_MIN_WAIT = float(os.getenv("AGGREGATION_MIN_WAIT", 0.5))
+AGGREGATION_CADENCE_ALPHA = float(os.getenv("AGGREGATION_CADENCE_ALPHA", 0.3))
+AGGREGATION_CADENCE_MAX_SENDERS = int(
+    os.getenv("AGGREGATION_CADENCE_MAX_SENDERS", 100000)
+)
+AGGREGATION_CADENCE_TTL = float(os.getenv("AGGREGATION_CADENCE_TTL", 86400))
+
+
+class SenderCadence:
+    """Typing cadence of one sender: EWMA mean and variance of message gaps."""
+
+    __slots__ = ("last_message_at", "gap", "variance")
+
+    def __init__(self, now: float, gap: float):
+        self.last_message_at = now
+        self.gap = gap
+        self.variance = 0.0
+
+
+class CadenceModel:
+    """
+    Learn how long to wait for each sender's next fragment.
+
+    Every gap between two messages of a sender updates an exponentially
+    weighted mean and variance. A gap longer than ``max_wait`` ends a burst and
+    counts as a ``min_wait`` sample, so senders who write complete messages
+    converge to the shortest window, while senders who type in fragments
+    converge to mean + 2 std of their own gaps. Windows are clamped to
+    ``[min_wait, max_wait]`` and new senders start at ``default_wait``.
+    """
+
+    def __init__(
+        self,
+        default_wait: float,
+        max_wait: float,
+        min_wait: float = AGGREGATION_MIN_WAIT,
+        alpha: float = AGGREGATION_CADENCE_ALPHA,
+        max_senders: int = AGGREGATION_CADENCE_MAX_SENDERS,
+        idle_ttl: float = AGGREGATION_CADENCE_TTL,
+    ):
+        self.default_wait = default_wait
+        self.min_wait = min(min_wait, max_wait)
+        self.max_wait = max_wait
+        self.alpha = alpha
+        self._senders = SenderTable("cadence", max_senders, idle_ttl)
+
+    def observe(self, sender_id: str, now: float) -> Optional[float]:
+        """
+        Record a message of the sender.
+
+        Returns:
+            float: Seconds since the sender's previous message, None if unknown.
+        """
+        cadence = self._senders.get(sender_id)
+        if cadence is None:
+            self._senders.set(sender_id, SenderCadence(now, self.default_wait))
+            return None
+
+        gap = now - cadence.last_message_at
+        sample = gap if gap <= self.max_wait else self.min_wait
+        diff = sample - cadence.gap
+        cadence.gap += self.alpha * diff
+        cadence.variance = (1 - self.alpha) * (
+            cadence.variance + self.alpha * diff * diff
+        )
+        cadence.last_message_at = now
+        self._senders.set(sender_id, cadence)
+        metrics.observe("aggregation_adaptive_wait", self._wait(cadence))
+        return gap
+
+    def _wait(self, cadence: SenderCadence) -> float:
+        wait = cadence.gap + 2 * math.sqrt(cadence.variance)
+        return min(max(wait, self.min_wait), self.max_wait)
+
+    def wait_time(self, sender_id: str) -> float:
+        """Seconds to wait for the sender's next message before answering."""
+        cadence = self._senders.get(sender_id)
+        if cadence is None:
+            return self.default_wait
+        return self._wait(cadence)
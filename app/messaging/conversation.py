@@ -0,0 +1,168 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+from psycopg_pool import AsyncConnectionPool
+
+from app.config.logging import logger
+from app.messaging.admission import AGENT_MAX_CONCURRENT_TURNS
+from app.messaging.store import AGGREGATION_STORE, Entry, Flushed
+from app.src.postgres.pool import (
+    PSQL_LOCK_POOL_MAX_SIZE,
+    create_lock_pool,
+    open_pool,
+)
+from app.utils.metrics import metrics
+
+TurnCallback = Callable[[str, List[Entry], dict], Awaitable]
+
+
+class ConversationRunner:
+    """
+    Run the turns of each conversation strictly in order.
+
+    Every sender has at most one turn in flight, so turns never race on the
+    same checkpoint. Messages submitted while a turn is running are merged into
+    the next turn, and different senders still run fully in parallel.
+    """
+
+    def __init__(self, run_turn: TurnCallback):
+        self.run_turn = run_turn
+        self._pending: Dict[str, Tuple[List[Entry], dict]] = {}
+        self._running: Dict[str, Tuple[List[Entry], dict]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        metrics.register_gauge("conversations_in_flight", lambda: len(self._workers))
+
+    async def submit(
+        self, sender_id: str, messages: List[Entry], context: dict
+    ) -> None:
+        """Queue messages for the sender's next turn, starting it if the sender is idle."""
+        pending = self._pending.get(sender_id)
+        if pending is None:
+            self._pending[sender_id] = (list(messages), dict(context))
+        else:
+            pending[0].extend(messages)
+            pending[1].update(context)
+            metrics.increment("conversation_turns_merged")
+
+        if sender_id not in self._workers:
+            self._workers[sender_id] = asyncio.create_task(self._run(sender_id))
+
+    async def join(self) -> None:
+        """Wait until every conversation is idle."""
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    async def drain(self, timeout: float) -> Dict[str, Flushed]:
+        """
+        Wait up to ``timeout`` seconds for the turns in flight, then cancel the rest.
+
+        Returns:
+            dict: The messages of the turns that did not finish, by sender.
+        """
+        deadline = time.monotonic() + timeout
+        while self._workers:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.wait(list(self._workers.values()), timeout=remaining)
+
+        workers = list(self._workers.values())
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._workers.clear()
+
+        unfinished: Dict[str, Flushed] = {}
+        for turns in (self._running, self._pending):
+            for sender_id, (messages, context) in turns.items():
+                entries, sender_context = unfinished.setdefault(sender_id, ([], {}))
+                entries.extend(messages)
+                sender_context.update(context)
+        self._running.clear()
+        self._pending.clear()
+        return unfinished
+
+    async def _run(self, sender_id: str) -> None:
+        """Run the sender's turns one after the other until nothing is pending."""
+        try:
+            while sender_id in self._pending:
+                messages, context = self._pending.pop(sender_id)
+                self._running[sender_id] = (messages, context)
+                try:
+                    await self.run_turn(sender_id, messages, context)
+                except Exception as e:
+                    logger.error(f"Error running turn for {sender_id}: {e}")
+                # A cancelled turn stays in _running, see drain
+                del self._running[sender_id]
+        finally:
+            self._workers.pop(sender_id, None)
+
+
+class TurnLock:
+    """
+    Keep a conversation to one turn at a time across processes.
+
+    Within a process the ConversationRunner already serializes the turns of a
+    sender, so the base lock does nothing.
+    """
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @asynccontextmanager
+    async def hold(self, thread_id: str) -> AsyncIterator[None]:
+        """Hold the conversation ``thread_id`` while the block runs."""
+        yield
+
+
+class PostgresTurnLock(TurnLock):
+    """
+    Turn lock shared by every worker and replica through Postgres.
+
+    With a shared aggregation store, the next window of a sender can be
+    flushed by another worker while their previous turn is still running. The
+    turn holds a transaction-level advisory lock on its thread for its whole
+    duration, so the other worker waits instead of writing the same
+    checkpoint. The lock is released when the turn ends, or by Postgres if the
+    process dies.
+
+    Each running turn keeps a connection of ``pool`` busy, so the locks have a
+    pool of their own, sized for the concurrent turns (see create_lock_pool).
+    """
+
+    LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtextextended(%s, 0))"
+
+    def __init__(self, pool: AsyncConnectionPool):
+        self.pool = pool
+
+    async def open(self) -> None:
+        await open_pool(self.pool)
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+    @asynccontextmanager
+    async def hold(self, thread_id: str) -> AsyncIterator[None]:
+        async with self.pool.connection() as conn, conn.transaction():
+            start = time.monotonic()
+            await conn.execute(self.LOCK_SQL, (thread_id,))
+            metrics.observe("conversation_lock_wait", time.monotonic() - start)
+            yield
+
+
+def create_turn_lock(backend: str = AGGREGATION_STORE) -> TurnLock:
+    """Create the turn lock matching the aggregation store, open it before use."""
+    if backend == "postgres":
+        if PSQL_LOCK_POOL_MAX_SIZE < AGENT_MAX_CONCURRENT_TURNS:
+            logger.warning(
+                f"PSQL_LOCK_POOL_MAX_SIZE={PSQL_LOCK_POOL_MAX_SIZE} is below "
+                f"AGENT_MAX_CONCURRENT_TURNS={AGENT_MAX_CONCURRENT_TURNS}, "
+                "turns will wait for a lock connection"
+            )
+        return PostgresTurnLock(create_lock_pool())
+    return TurnLock()
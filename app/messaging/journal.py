@@ -0,0 +1,236 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.config.logging import logger
+from app.messaging.store import Flushed
+from app.utils.metrics import metrics
+
+load_dotenv()
+
+MESSAGE_JOURNAL_ENABLED = os.getenv("MESSAGE_JOURNAL_ENABLED", "true").lower() == "true"
+MESSAGE_JOURNAL_PATH = os.getenv(
+    "MESSAGE_JOURNAL_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "journal.db"),
+)
+MESSAGE_JOURNAL_MAX_BATCH = int(os.getenv("MESSAGE_JOURNAL_MAX_BATCH", 256))
+MESSAGE_JOURNAL_RETENTION = float(os.getenv("MESSAGE_JOURNAL_RETENTION", 86400))
+MESSAGE_JOURNAL_PURGE_INTERVAL = float(
+    os.getenv("MESSAGE_JOURNAL_PURGE_INTERVAL", 600)
+)
+MESSAGE_JOURNAL_PURGE_BATCH = int(os.getenv("MESSAGE_JOURNAL_PURGE_BATCH", 1000))
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS inbound_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sender_id TEXT NOT NULL,
+    body TEXT NOT NULL,
+    type TEXT NOT NULL,
+    context TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    processed_at REAL
+)
+"""
+
+CREATE_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS inbound_messages_unprocessed
+ON inbound_messages (id) WHERE processed_at IS NULL
+"""
+
+CREATE_PROCESSED_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS inbound_messages_processed
+ON inbound_messages (processed_at) WHERE processed_at IS NOT NULL
+"""
+
+PURGE_SQL = """
+DELETE FROM inbound_messages WHERE id IN (
+    SELECT id FROM inbound_messages WHERE processed_at < ? LIMIT ?
+)
+"""
+
+
+class MessageJournal:
+    """
+    Durable log of inbound messages in a local SQLite database (WAL mode).
+
+    The webhook appends every message before acknowledging it and marks it
+    processed once its turn is over, so whatever was buffered or in flight when
+    the process stopped is replayed by the next instance.
+
+    Writes go through a single writer task with group commit: every append
+    queued while a transaction is being committed is written by the next one,
+    so one fsync acknowledges a whole burst of webhooks.
+
+    Processed messages are deleted once they are ``retention`` seconds old, by
+    the writer every ``purge_interval`` seconds, at most ``purge_batch`` rows
+    at a time so appends don't wait behind a large purge.
+    """
+
+    def __init__(
+        self,
+        path: str = MESSAGE_JOURNAL_PATH,
+        max_batch: int = MESSAGE_JOURNAL_MAX_BATCH,
+        retention: float = MESSAGE_JOURNAL_RETENTION,
+        purge_interval: float = MESSAGE_JOURNAL_PURGE_INTERVAL,
+        purge_batch: int = MESSAGE_JOURNAL_PURGE_BATCH,
+    ):
+        self.path = path
+        self.max_batch = max_batch
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self.purge_batch = purge_batch
+        self._next_purge = 0.0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    async def open(self) -> Dict[str, Flushed]:
+        """
+        Open the journal and start the writer.
+
+        Returns:
+            dict: The unfinished messages of every sender, in arrival order,
+            as ``(entries, context)`` ready to be submitted as turns.
+        """
+        unfinished = await asyncio.to_thread(self._open)
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+        return unfinished
+
+    async def close(self) -> None:
+        """Commit the queued writes and close the database."""
+        if self._writer:
+            self._queue.put_nowait(None)
+            await self._writer
+            self._writer = None
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    async def append(
+        self, sender_id: str, body: str, type: str, context: dict
+    ) -> int:
+        """Durably record an inbound message and return its journal id."""
+        return await self._submit(
+            "append", (sender_id, body, type, json.dumps(context), time.time())
+        )
+
+    async def mark_processed(self, ids: List[int]) -> None:
+        """Mark the messages of a finished turn so they are not replayed."""
+        if ids:
+            await self._submit("processed", ids)
+
+    async def _submit(self, operation: str, params: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((operation, params, future))
+        return await future
+
+    def _open(self) -> Dict[str, Flushed]:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute(CREATE_TABLE_SQL)
+        conn.execute(CREATE_INDEX_SQL)
+        conn.execute(CREATE_PROCESSED_INDEX_SQL)
+        self._conn = conn
+
+        unfinished: Dict[str, Flushed] = {}
+        rows = conn.execute(
+            "SELECT id, sender_id, body, type, context FROM inbound_messages "
+            "WHERE processed_at IS NULL ORDER BY id"
+        )
+        for id, sender_id, body, type, context in rows:
+            entries, sender_context = unfinished.setdefault(sender_id, ([], {}))
+            if type == "ptt":
+                # Voice notes are journaled as audio, transcribed when replayed
+                entries.append(
+                    {"text": None, "audio": body, "journal_id": id, "type": type}
+                )
+            else:
+                entries.append({"text": body, "journal_id": id, "type": type})
+            sender_context.update(json.loads(context))
+        return unfinished
+
+    def _commit(self, batch: List[Tuple[str, Any, asyncio.Future]]) -> List[Any]:
+        """Write a batch of operations in a single transaction."""
+        results = []
+        cursor = self._conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            for operation, params, _ in batch:
+                if operation == "append":
+                    cursor.execute(
+                        "INSERT INTO inbound_messages "
+                        "(sender_id, body, type, context, received_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        params,
+                    )
+                    results.append(cursor.lastrowid)
+                else:
+                    now = time.time()
+                    cursor.executemany(
+                        "UPDATE inbound_messages SET processed_at = ? WHERE id = ?",
+                        [(now, id) for id in params],
+                    )
+                    results.append(None)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        return results
+
+    def _purge(self) -> int:
+        """Delete a batch of expired processed messages, return how many."""
+        cursor = self._conn.execute(
+            PURGE_SQL, (time.time() - self.retention, self.purge_batch)
+        )
+        return cursor.rowcount
+
+    async def _purge_if_due(self) -> None:
+        if time.monotonic() < self._next_purge:
+            return
+        try:
+            purged = await asyncio.to_thread(self._purge)
+        except Exception as e:
+            logger.error(f"Error purging the message journal: {e}")
+            purged = 0
+        metrics.increment("message_journal_purged", purged)
+        # A full batch means there is more to delete, go on after the next write
+        if purged < self.purge_batch:
+            self._next_purge = time.monotonic() + self.purge_interval
+
+    async def _write_loop(self) -> None:
+        """Commit queued operations in batches until ``close`` is called."""
+        closing = False
+        while not closing:
+            operation = await self._queue.get()
+            batch = []
+            while operation is not None:
+                batch.append(operation)
+                if len(batch) >= self.max_batch or self._queue.empty():
+                    break
+                operation = self._queue.get_nowait()
+            closing = operation is None
+            if not batch:
+                continue
+
+            try:
+                results = await asyncio.to_thread(self._commit, batch)
+            except Exception as e:
+                logger.error(f"Error writing the message journal: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            metrics.observe("message_journal_batch_size", len(batch))
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            await self._purge_if_due()
@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+from app.utils.metrics import metrics
+
+
+class SenderTable:
+    """
+    Per-sender state with idle-TTL eviction and a hard cap on live senders.
+
+    Entries are kept in least-recently-active order: ``touch``/``set`` move a
+    sender to the end, and expired or excess senders are evicted from the front,
+    so eviction costs O(1) per evicted entry. ``on_evict`` is called with the
+    sender id and its value for every eviction (not for ``pop``).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_senders: int,
+        idle_ttl: float,
+        on_evict: Optional[Callable[[str, Any], None]] = None,
+    ):
+        self.name = name
+        self.max_senders = max_senders
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        metrics.register_gauge(f"{name}_senders_live", lambda: len(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, sender_id: str) -> bool:
+        return sender_id in self._entries
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        return ((sender_id, entry[1]) for sender_id, entry in self._entries.items())
+
+    def get(self, sender_id: str, default: Any = None) -> Any:
+        """Return the sender's value without refreshing its activity."""
+        entry = self._entries.get(sender_id)
+        return default if entry is None else entry[1]
+
+    def touch(self, sender_id: str) -> None:
+        """Mark the sender as active now."""
+        value = self._entries.pop(sender_id)[1]
+        self._entries[sender_id] = (time.monotonic(), value)
+
+    def set(self, sender_id: str, value: Any) -> None:
+        """Store the sender's value, marking it as active and enforcing the bounds."""
+        self._entries.pop(sender_id, None)
+        self._entries[sender_id] = (time.monotonic(), value)
+        self.evict()
+
+    def pop(self, sender_id: str, default: Any = None) -> Any:
+        entry = self._entries.pop(sender_id, None)
+        return default if entry is None else entry[1]
+
+    def evict(self) -> int:
+        """Evict idle senders and the least recently active ones above the cap."""
+        evicted = 0
+        expired_before = time.monotonic() - self.idle_ttl
+        while self._entries:
+            sender_id, (last_active, value) = next(iter(self._entries.items()))
+            if last_active >= expired_before and len(self._entries) <= self.max_senders:
+                break
+            del self._entries[sender_id]
+            evicted += 1
+            if self.on_evict:
+                self.on_evict(sender_id, value)
+        if evicted:
+            metrics.increment(f"{self.name}_senders_evicted", evicted)
+        return evicted
@@ -0,0 +1,300 @@
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+from app.config.logging import logger
+from app.messaging.senders import SenderTable
+
+load_dotenv()
+
+AGGREGATION_STORE = os.getenv("AGGREGATION_STORE", "memory")
+AGGREGATION_MAX_SENDERS = int(os.getenv("AGGREGATION_MAX_SENDERS", 100000))
+AGGREGATION_IDLE_TTL = float(os.getenv("AGGREGATION_IDLE_TTL", 300))
+
+# A buffered message: {"text": str, "journal_id": Optional[int], "type": str}.
+# Voice notes being transcribed have "text" None, their base64 "audio" and a
+# "placeholder" id (see BackgroundTranscriber)
+Entry = Dict[str, Any]
+
+# Buffered messages and context flushed from a window
+Flushed = Tuple[List[Entry], dict]
+
+
+class AggregationWindow:
+    """Messages buffered for one sender while their aggregation window is open."""
+
+    __slots__ = (
+        "messages",
+        "context",
+        "opened_at",
+        "last_message_at",
+        "flush_now",
+        "owner",
+        "lease_until",
+    )
+
+    def __init__(self, owner: str, lease_until: float, now: float):
+        self.messages: List[Entry] = []
+        self.context: dict = {}
+        self.opened_at = now
+        self.last_message_at = now
+        self.flush_now = False
+        self.owner = owner
+        self.lease_until = lease_until
+
+
+class AggregationStore:
+    """
+    Where the senders' buffered messages and window ownership live.
+
+    The owner of a window is the process running its timer. Ownership is a
+    lease: the owner renews it while the window is open, and another process
+    takes the window over once the lease expires (e.g. the owner crashed).
+    Timestamps are wall-clock seconds so they compare across processes.
+    """
+
+    async def setup(self) -> None:
+        """Create whatever the backend needs (tables...)."""
+
+    async def append(
+        self,
+        sender_id: str,
+        message: Entry,
+        context: dict,
+        owner: str,
+        lease_until: float,
+        flush_now: bool = False,
+    ) -> bool:
+        """
+        Append a message to the sender's window, opening it if needed.
+
+        Returns:
+            bool: True if ``owner`` opened the window or took it over, in which
+            case it must run the window timer.
+        """
+        raise NotImplementedError
+
+    async def renew(
+        self, sender_id: str, owner: str, lease_until: float
+    ) -> Optional[AggregationWindow]:
+        """Extend the lease of ``owner`` and return the window, or None if not the owner."""
+        raise NotImplementedError
+
+    async def close(self, sender_id: str, owner: str) -> Optional[Flushed]:
+        """Remove the window and return its messages, or None if not the owner."""
+        raise NotImplementedError
+
+    async def claim_expired(self, owner: str, lease_until: float) -> List[str]:
+        """Take over the windows whose lease expired and return their sender ids."""
+        raise NotImplementedError
+
+
+class MemoryAggregationStore(AggregationStore):
+    """
+    Aggregation state kept in the process, for a single worker.
+
+    Windows live in a SenderTable: a window nobody appended to for
+    ``idle_ttl`` seconds (its owner is gone) is evicted, and at most
+    ``max_senders`` windows are open at once.
+    """
+
+    def __init__(
+        self,
+        max_senders: int = AGGREGATION_MAX_SENDERS,
+        idle_ttl: float = AGGREGATION_IDLE_TTL,
+    ):
+        self._windows = SenderTable(
+            "aggregation", max_senders, idle_ttl, on_evict=self._on_evict
+        )
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    @staticmethod
+    def _on_evict(sender_id: str, window: AggregationWindow) -> None:
+        logger.warning(
+            f"Evicted the aggregation window of {sender_id} "
+            f"with {len(window.messages)} messages"
+        )
+
+    async def append(
+        self, sender_id, message, context, owner, lease_until, flush_now=False
+    ):
+        now = time.time()
+        window = self._windows.get(sender_id)
+        claimed = window is None or window.lease_until < now
+        if window is None:
+            window = AggregationWindow(owner, lease_until, now)
+            self._windows.set(sender_id, window)
+        else:
+            self._windows.touch(sender_id)
+            if claimed:
+                window.owner = owner
+                window.lease_until = lease_until
+
+        window.messages.append(message)
+        window.context.update(context)
+        window.last_message_at = now
+        window.flush_now = window.flush_now or flush_now
+        return claimed
+
+    async def renew(self, sender_id, owner, lease_until):
+        window = self._windows.get(sender_id)
+        if window is None or window.owner != owner:
+            return None
+        window.lease_until = lease_until
+        return window
+
+    async def close(self, sender_id, owner):
+        window = self._windows.get(sender_id)
+        if window is None or window.owner != owner:
+            return None
+        self._windows.pop(sender_id)
+        return window.messages, window.context
+
+    async def claim_expired(self, owner, lease_until):
+        self._windows.evict()
+        now = time.time()
+        claimed = []
+        for sender_id, window in self._windows.items():
+            if window.lease_until < now:
+                window.owner = owner
+                window.lease_until = lease_until
+                claimed.append(sender_id)
+        return claimed
+
+
+class PostgresAggregationStore(AggregationStore):
+    """
+    Aggregation state shared by every worker and replica through Postgres.
+
+    Row locks make appends and ownership changes atomic, so any number of
+    uvicorn workers can receive messages from the same sender. It runs against
+    any Postgres instance, a local container is enough to try it out.
+    """
+
+    CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS aggregation_windows (
+        sender_id TEXT PRIMARY KEY,
+        messages JSONB NOT NULL DEFAULT '[]',
+        context JSONB NOT NULL DEFAULT '{}',
+        opened_at DOUBLE PRECISION NOT NULL,
+        last_message_at DOUBLE PRECISION NOT NULL,
+        flush_now BOOLEAN NOT NULL DEFAULT false,
+        owner TEXT NOT NULL,
+        lease_until DOUBLE PRECISION NOT NULL
+    )
+    """
+
+    # The lease value is unique to this call: finding it in the row means that
+    # this call inserted the window or took it over from an expired owner.
+    APPEND_SQL = """
+    INSERT INTO aggregation_windows AS w (
+        sender_id, messages, context, opened_at, last_message_at,
+        flush_now, owner, lease_until
+    )
+    VALUES (
+        %(sender_id)s, jsonb_build_array(%(message)s), %(context)s,
+        %(now)s, %(now)s, %(flush_now)s, %(owner)s, %(lease_until)s
+    )
+    ON CONFLICT (sender_id) DO UPDATE SET
+        messages = w.messages || EXCLUDED.messages,
+        context = w.context || EXCLUDED.context,
+        last_message_at = EXCLUDED.last_message_at,
+        flush_now = w.flush_now OR EXCLUDED.flush_now,
+        owner = CASE WHEN w.lease_until < EXCLUDED.last_message_at
+            THEN EXCLUDED.owner ELSE w.owner END,
+        lease_until = CASE WHEN w.lease_until < EXCLUDED.last_message_at
+            THEN EXCLUDED.lease_until ELSE w.lease_until END
+    RETURNING owner = %(owner)s AND lease_until = %(lease_until)s AS claimed
+    """
+
+    RENEW_SQL = """
+    UPDATE aggregation_windows SET lease_until = %(lease_until)s
+    WHERE sender_id = %(sender_id)s AND owner = %(owner)s
+    RETURNING opened_at, last_message_at, flush_now
+    """
+
+    CLOSE_SQL = """
+    DELETE FROM aggregation_windows
+    WHERE sender_id = %(sender_id)s AND owner = %(owner)s
+    RETURNING messages, context
+    """
+
+    CLAIM_EXPIRED_SQL = """
+    UPDATE aggregation_windows SET owner = %(owner)s, lease_until = %(lease_until)s
+    WHERE lease_until < %(now)s
+    RETURNING sender_id
+    """
+
+    def __init__(self, pool: AsyncConnectionPool):
+        self.pool = pool
+
+    async def _fetchone(self, query: str, params: dict) -> Optional[dict]:
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(query, params)
+            return await cursor.fetchone()
+
+    async def setup(self):
+        async with self.pool.connection() as conn:
+            await conn.execute(self.CREATE_TABLE_SQL)
+
+    async def append(
+        self, sender_id, message, context, owner, lease_until, flush_now=False
+    ):
+        row = await self._fetchone(
+            self.APPEND_SQL,
+            {
+                "sender_id": sender_id,
+                "message": Jsonb(message),
+                "context": Jsonb(context),
+                "now": time.time(),
+                "flush_now": flush_now,
+                "owner": owner,
+                "lease_until": lease_until,
+            },
+        )
+        return row["claimed"]
+
+    async def renew(self, sender_id, owner, lease_until):
+        row = await self._fetchone(
+            self.RENEW_SQL,
+            {"sender_id": sender_id, "owner": owner, "lease_until": lease_until},
+        )
+        if row is None:
+            return None
+        window = AggregationWindow(owner, lease_until, row["opened_at"])
+        window.last_message_at = row["last_message_at"]
+        window.flush_now = row["flush_now"]
+        return window
+
+    async def close(self, sender_id, owner):
+        row = await self._fetchone(
+            self.CLOSE_SQL, {"sender_id": sender_id, "owner": owner}
+        )
+        if row is None:
+            return None
+        return row["messages"], row["context"]
+
+    async def claim_expired(self, owner, lease_until):
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(
+                self.CLAIM_EXPIRED_SQL,
+                {"owner": owner, "lease_until": lease_until, "now": time.time()},
+            )
+            return [row["sender_id"] for row in await cursor.fetchall()]
+
+
+def create_aggregation_store(
+    pool: AsyncConnectionPool, backend: str = AGGREGATION_STORE
+) -> AggregationStore:
+    """Create the aggregation store selected by ``AGGREGATION_STORE``."""
+    if backend == "memory":
+        return MemoryAggregationStore()
+    if backend == "postgres":
+        return PostgresAggregationStore(pool)
+    raise ValueError(f"Unknown aggregation store: {backend}")
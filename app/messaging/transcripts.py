@@ -0,0 +1,120 @@
+import asyncio
+import itertools
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+from app.config.logging import logger
+from app.messaging.store import Entry
+from app.utils.metrics import metrics
+
+load_dotenv()
+
+VOICE_NOTE_FAILED_TEXT = os.getenv(
+    "VOICE_NOTE_FAILED_TEXT", "[voice note that could not be transcribed]"
+)
+
+# Transcriptions nobody collected (their window was flushed by another worker)
+# are forgotten after this many seconds
+UNCLAIMED_TRANSCRIPTION_TTL = 600
+
+TurnCallback = Callable[[str, List[Entry], dict], Awaitable]
+
+
+class BackgroundTranscriber:
+    """
+    Transcribe voice notes in the background while their window is open.
+
+    The webhook buffers a voice note as a placeholder entry (``text`` None,
+    ``audio`` the base64 note, ``placeholder`` the id returned by ``start``: a
+    per-process token and a sequence number) and returns right away. When the
+    window flushes, ``submit`` fills the placeholders with their transcripts,
+    waiting only for those still running, and hands the turn to
+    ``submit_turn``. Placeholders keep their position, so messages stay in the
+    order they arrived, and a sender's turns are handed over in the order their
+    windows flushed.
+
+    A placeholder whose transcription isn't running in this process (replayed
+    from the journal, or buffered by another worker) is transcribed from its
+    ``audio`` then.
+    """
+
+    def __init__(
+        self,
+        transcribe: Callable[[str], Awaitable[str]],
+        submit_turn: TurnCallback,
+        failed_text: str = VOICE_NOTE_FAILED_TEXT,
+    ):
+        self.transcribe = transcribe
+        self.submit_turn = submit_turn
+        self.failed_text = failed_text
+        self._token = uuid.uuid4().hex[:8]
+        self._sequence = itertools.count(1)
+        self._tasks: Dict[str, Tuple[float, asyncio.Task]] = {}
+        self._flushing: Dict[str, asyncio.Future] = {}
+        metrics.register_gauge(
+            "voice_notes_transcribing",
+            lambda: sum(not task.done() for _, task in self._tasks.values()),
+        )
+
+    def start(self, base64_audio: str) -> str:
+        """Start transcribing a voice note and return its placeholder id."""
+        self._forget_unclaimed()
+        placeholder = f"{self._token}-{next(self._sequence)}"
+        task = asyncio.create_task(self._transcribe(base64_audio))
+        self._tasks[placeholder] = (time.monotonic(), task)
+        return placeholder
+
+    async def submit(
+        self, sender_id: str, messages: List[Entry], context: dict
+    ) -> None:
+        """Fill the voice-note placeholders of a turn, then hand the turn over."""
+        previous = self._flushing.get(sender_id)
+        flushed = asyncio.get_running_loop().create_future()
+        self._flushing[sender_id] = flushed
+        try:
+            messages = await self._resolve(messages)
+            if previous:
+                # An earlier window of the sender is still waiting for its notes
+                await previous
+            await self.submit_turn(sender_id, messages, context)
+        finally:
+            flushed.set_result(None)
+            if self._flushing.get(sender_id) is flushed:
+                del self._flushing[sender_id]
+
+    async def _resolve(self, messages: List[Entry]) -> List[Entry]:
+        async def resolve(message: Entry) -> Entry:
+            if message.get("text") is not None:
+                return message
+            start = time.monotonic()
+            _, task = self._tasks.pop(message.get("placeholder"), (None, None))
+            if task is None:
+                text = await self._transcribe(message["audio"])
+            else:
+                text = await task
+            metrics.observe("voice_note_flush_wait", time.monotonic() - start)
+            resolved = {k: v for k, v in message.items() if k != "audio"}
+            resolved["text"] = text
+            return resolved
+
+        return list(await asyncio.gather(*(resolve(m) for m in messages)))
+
+    async def _transcribe(self, base64_audio: str) -> str:
+        try:
+            text = await self.transcribe(base64_audio)
+            logger.info(f"Voice note transcribed: {text}")
+            return text
+        except Exception as e:
+            metrics.increment("voice_notes_failed")
+            logger.error(f"Error transcribing voice note: {e}")
+            return self.failed_text
+
+    def _forget_unclaimed(self) -> None:
+        expired_before = time.monotonic() - UNCLAIMED_TRANSCRIPTION_TTL
+        for placeholder, (started_at, task) in list(self._tasks.items()):
+            if started_at < expired_before and task.done():
+                del self._tasks[placeholder]
@@ -0,0 +1,314 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import multiprocessing
+import os
+import signal
+import time
+from typing import (
+    AsyncContextManager,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from dotenv import load_dotenv
+
+from app.config.logging import logger
+from app.messaging.conversation import ConversationRunner, TurnCallback
+from app.messaging.store import Entry, Flushed
+from app.utils.metrics import metrics
+
+load_dotenv()
+
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", 0))
+AGENT_WORKER_CHECK_INTERVAL = float(os.getenv("AGENT_WORKER_CHECK_INTERVAL", 5))
+AGENT_WORKER_MAX_TURN_DEATHS = int(os.getenv("AGENT_WORKER_MAX_TURN_DEATHS", 3))
+
+HASH_RING_REPLICAS = 64
+
+DoneCallback = Callable[[str, List[Entry]], Awaitable]
+
+# Worker index, sender id, messages and context of a turn handed to a worker
+Dispatch = Tuple[int, str, List[Entry], dict]
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping keys to nodes.
+
+    Every node is placed ``replicas`` times on the ring so keys spread evenly,
+    and the hash is stable across processes (unlike the built-in ``hash``).
+    """
+
+    def __init__(self, nodes: List[int], replicas: int = HASH_RING_REPLICAS):
+        self._ring = sorted(
+            (self._hash(f"{node}:{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def node_for(self, key: str) -> int:
+        """Return the node owning ``key``."""
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+def _worker_process(resources, run_turn, inbox, outbox) -> None:
+    """Entry point of an agent worker process."""
+    # The parent stops workers through their inbox, not with Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve(resources, run_turn, inbox, outbox))
+
+
+async def _serve(resources, run_turn: TurnCallback, inbox, outbox) -> None:
+    """Run the turns received on ``inbox`` until the ``None`` sentinel."""
+    # Dispatch ids received for each sender and not started yet
+    received: Dict[str, List[int]] = {}
+
+    async def turn(sender_id: str, messages: List[Entry], context: dict) -> None:
+        # The runner merges every dispatch queued before the turn starts, and
+        # starts it without yielding to submit: these ids are the merged ones
+        dispatch_ids = received.pop(sender_id)
+        outbox.put((dispatch_ids, "started"))
+        try:
+            await run_turn(sender_id, messages, context)
+        except Exception:
+            outbox.put((dispatch_ids, "failed"))
+            raise
+        outbox.put((dispatch_ids, "succeeded"))
+
+    async with resources():
+        runner = ConversationRunner(turn)
+        logger.info(f"Agent worker {os.getpid()} ready")
+        while True:
+            item = await asyncio.to_thread(inbox.get)
+            if item is None:
+                break
+            dispatch_id, sender_id, messages, context = item
+            received.setdefault(sender_id, []).append(dispatch_id)
+            await runner.submit(sender_id, messages, context)
+        await runner.join()
+    logger.info(f"Agent worker {os.getpid()} stopped")
+
+
+class AgentWorkerPool:
+    """
+    Run agent turns in a pool of worker processes.
+
+    Turns are partitioned by a consistent hash of the sender id, so all the
+    turns of a conversation go to the same worker, in order, and each worker
+    serializes them with its own ConversationRunner. The web process is left
+    with ingestion only (webhooks, aggregation, journaling).
+
+    Each worker opens its own resources through ``resources``, an async context
+    manager factory (pool, checkpointer, compiled graph), and runs ``run_turn``.
+    ``on_done`` is called in the web process when a turn has succeeded.
+
+    Every turn handed to a worker is kept under a dispatch id until the worker
+    reports it. A worker that dies is restarted on a fresh inbox and its
+    unreported turns are handed to it again, in order. The death counts against
+    every turn the worker had started: a turn that took its worker down
+    ``max_turn_deaths`` times is given up, and ``on_abandoned`` is called with it,
+    so it doesn't crash the worker of its partition forever.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        resources: Callable[[], AsyncContextManager],
+        run_turn: TurnCallback,
+        on_done: Optional[DoneCallback] = None,
+        check_interval: float = AGENT_WORKER_CHECK_INTERVAL,
+        max_turn_deaths: int = AGENT_WORKER_MAX_TURN_DEATHS,
+        on_abandoned: Optional[DoneCallback] = None,
+    ):
+        if size < 1:
+            raise ValueError("An agent worker pool needs at least one worker")
+        self.size = size
+        self.resources = resources
+        self.run_turn = run_turn
+        self.on_done = on_done
+        self.check_interval = check_interval
+        self.max_turn_deaths = max_turn_deaths
+        self.on_abandoned = on_abandoned
+        self.ring = HashRing(list(range(size)))
+        self._context = multiprocessing.get_context("spawn")
+        self._inboxes = [self._context.Queue() for _ in range(size)]
+        # Written synchronously, so a report survives the worker dying right after
+        self._outbox = self._context.SimpleQueue()
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * size
+        self._tasks: List[asyncio.Task] = []
+        # Turns handed to the workers and not reported back yet, by dispatch id
+        self._outstanding: Dict[int, Dispatch] = {}
+        self._dispatch_ids = itertools.count(1)
+        # Outstanding turns a worker has started, and the workers they took down
+        self._started: Set[int] = set()
+        self._deaths: Dict[int, int] = {}
+        metrics.register_gauge(
+            "agent_workers_alive",
+            lambda: sum(1 for p in self._processes if p and p.is_alive()),
+        )
+
+    def _spawn(self, index: int) -> None:
+        process = self._context.Process(
+            target=_worker_process,
+            args=(self.resources, self.run_turn, self._inboxes[index], self._outbox),
+            name=f"agent-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _forget(self, dispatch_id: int) -> Dispatch:
+        self._started.discard(dispatch_id)
+        self._deaths.pop(dispatch_id, None)
+        return self._outstanding.pop(dispatch_id)
+
+    def _restart(self, index: int) -> List[Dispatch]:
+        """
+        Restart a dead worker and hand it the turns it never reported.
+
+        Returns:
+            list: The turns given up because they took the worker down too often.
+        """
+        # Turns still queued in the old inbox are dispatched again below
+        inbox, self._inboxes[index] = self._inboxes[index], self._context.Queue()
+        inbox.cancel_join_thread()
+        inbox.close()
+        self._spawn(index)
+
+        abandoned = []
+        for dispatch_id in sorted(self._started):
+            if self._outstanding[dispatch_id][0] != index:
+                continue
+            self._started.discard(dispatch_id)
+            deaths = self._deaths.get(dispatch_id, 0) + 1
+            self._deaths[dispatch_id] = deaths
+            if deaths >= self.max_turn_deaths:
+                abandoned.append(self._forget(dispatch_id))
+                logger.error(
+                    f"Giving up turn {dispatch_id} of {abandoned[-1][1]}, "
+                    f"it took agent-worker-{index} down {deaths} times"
+                )
+        if abandoned:
+            metrics.increment("agent_worker_turns_abandoned", len(abandoned))
+
+        lost = sorted(
+            (dispatch_id, dispatch)
+            for dispatch_id, dispatch in self._outstanding.items()
+            if dispatch[0] == index
+        )
+        for dispatch_id, (_, sender_id, messages, context) in lost:
+            self._inboxes[index].put((dispatch_id, sender_id, messages, context))
+        if lost:
+            metrics.increment("agent_worker_turns_redispatched", len(lost))
+            logger.warning(
+                f"Dispatched {len(lost)} turns again to agent-worker-{index}"
+            )
+        return abandoned
+
+    async def start(self) -> None:
+        """Start the workers and the tasks collecting their results."""
+        for index in range(self.size):
+            self._spawn(index)
+        self._tasks = [
+            asyncio.create_task(self._collect()),
+            asyncio.create_task(self._watch()),
+        ]
+        logger.info(f"Started {self.size} agent workers")
+
+    async def submit(
+        self, sender_id: str, messages: List[Entry], context: dict
+    ) -> None:
+        """Hand a turn to the worker owning the sender."""
+        index = self.ring.node_for(sender_id)
+        dispatch_id = next(self._dispatch_ids)
+        self._outstanding[dispatch_id] = (index, sender_id, messages, context)
+        self._inboxes[index].put((dispatch_id, sender_id, messages, context))
+        metrics.increment("agent_worker_turns_dispatched")
+
+    async def stop(self, timeout: float) -> Dict[str, Flushed]:
+        """
+        Let the workers finish their queued turns for up to ``timeout`` seconds,
+        then terminate them.
+
+        Returns:
+            dict: The messages of the turns that did not finish, by sender.
+        """
+        self._tasks[1].cancel()
+        for inbox in self._inboxes:
+            inbox.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            remaining = max(deadline - time.monotonic(), 0)
+            await asyncio.to_thread(process.join, remaining)
+            if process.is_alive():
+                logger.warning(f"Terminating {process.name}, it did not stop in time")
+                process.terminate()
+        self._outbox.put(None)
+        await self._tasks[0]
+
+        unfinished: Dict[str, Flushed] = {}
+        for dispatch_id in sorted(self._outstanding):
+            _, sender_id, messages, context = self._outstanding[dispatch_id]
+            entries, sender_context = unfinished.setdefault(sender_id, ([], {}))
+            entries.extend(messages)
+            sender_context.update(context)
+        self._outstanding = {}
+        self._started = set()
+        self._deaths = {}
+        return unfinished
+
+    async def _collect(self) -> None:
+        """Report the turns finished by the workers, until ``stop``."""
+        while True:
+            item = await asyncio.to_thread(self._outbox.get)
+            if item is None:
+                return
+            dispatch_ids, status = item
+            # A turn dispatched again after a restart may be reported twice
+            known = [i for i in dispatch_ids if i in self._outstanding]
+            if status == "started":
+                self._started.update(known)
+                continue
+            dispatches = [self._forget(dispatch_id) for dispatch_id in known]
+            if dispatches and status == "succeeded":
+                await self._report(self.on_done, dispatches)
+
+    async def _report(
+        self, callback: Optional[DoneCallback], dispatches: List[Dispatch]
+    ) -> None:
+        """Call ``callback`` with the messages of a sender's dispatches."""
+        if not callback:
+            return
+        sender_id = dispatches[0][1]
+        messages = [entry for _, _, entries, _ in dispatches for entry in entries]
+        try:
+            await callback(sender_id, messages)
+        except Exception as e:
+            logger.error(f"Error completing turn for {sender_id}: {e}")
+
+    async def _watch(self) -> None:
+        """Restart the workers that died."""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    logger.error(
+                        f"{process.name} exited with code {process.exitcode}, restarting it"
+                    )
+                    metrics.increment("agent_worker_restarts")
+                    for dispatch in self._restart(index):
+                        await self._report(self.on_abandoned, [dispatch])
@@ -0,0 +1,74 @@
+import os
+from typing import Dict
+
+from dotenv import load_dotenv
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from app.config.logging import logger
+
+load_dotenv()
+
+PSQL_POOL_MIN_SIZE = int(os.getenv("PSQL_POOL_MIN_SIZE", 2))
+PSQL_POOL_MAX_SIZE = int(os.getenv("PSQL_POOL_MAX_SIZE", 20))
+PSQL_POOL_MAX_IDLE = float(os.getenv("PSQL_POOL_MAX_IDLE", 300))
+PSQL_POOL_TIMEOUT = float(os.getenv("PSQL_POOL_TIMEOUT", 30))
+PSQL_POOL_CHECK = os.getenv("PSQL_POOL_CHECK", "true").lower() == "true"
+PSQL_LOCK_POOL_MAX_SIZE = int(os.getenv("PSQL_LOCK_POOL_MAX_SIZE", 16))
+
+
+def create_pool() -> AsyncConnectionPool:
+    """
+    Create the process-wide Postgres connection pool.
+
+    The pool is created closed; open it once at startup (``await pool.open()``)
+    and close it on shutdown so every turn reuses warm connections.
+    """
+    return AsyncConnectionPool(
+        conninfo=os.getenv("PSQL_CONNECTION_STRING"),
+        min_size=PSQL_POOL_MIN_SIZE,
+        max_size=PSQL_POOL_MAX_SIZE,
+        max_idle=PSQL_POOL_MAX_IDLE,
+        timeout=PSQL_POOL_TIMEOUT,
+        check=AsyncConnectionPool.check_connection if PSQL_POOL_CHECK else None,
+        name="checkpointer",
+        open=False,
+        kwargs={
+            "autocommit": True,
+            "prepare_threshold": 0,
+            "row_factory": dict_row,
+        },
+    )
+
+
+def create_lock_pool(max_size: int = PSQL_LOCK_POOL_MAX_SIZE) -> AsyncConnectionPool:
+    """
+    Create the pool holding the conversation locks (see PostgresTurnLock).
+
+    A lock keeps its connection for a whole turn, so the locks get their own
+    pool instead of starving the checkpointer and the aggregation store.
+    """
+    return AsyncConnectionPool(
+        conninfo=os.getenv("PSQL_CONNECTION_STRING"),
+        min_size=1,
+        max_size=max_size,
+        max_idle=PSQL_POOL_MAX_IDLE,
+        timeout=PSQL_POOL_TIMEOUT,
+        check=AsyncConnectionPool.check_connection if PSQL_POOL_CHECK else None,
+        name="turn-locks",
+        open=False,
+        kwargs={"autocommit": True, "prepare_threshold": 0},
+    )
+
+
+async def open_pool(pool: AsyncConnectionPool) -> None:
+    """Open the pool and wait until ``min_size`` connections are ready."""
+    await pool.open(wait=True)
+    logger.info(
+        f"Postgres pool opened (min_size={pool.min_size}, max_size={pool.max_size})"
+    )
+
+
+def get_pool_stats(pool: AsyncConnectionPool) -> Dict[str, int]:
+    """Return the pool statistics (size, idle connections, waiting clients...)."""
+    return pool.get_stats()
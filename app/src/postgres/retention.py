@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import os
+from typing import Dict
+
+from dotenv import load_dotenv
+from psycopg_pool import AsyncConnectionPool
+
+from app.config.logging import logger
+from app.src.postgres.pool import create_pool, open_pool
+from app.utils.metrics import metrics
+
+load_dotenv()
+
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", 10))
+# Threads pruned per batch
+CHECKPOINT_PRUNE_BATCH_SIZE = int(os.getenv("CHECKPOINT_PRUNE_BATCH_SIZE", 100))
+CHECKPOINT_PRUNE_INTERVAL = float(os.getenv("CHECKPOINT_PRUNE_INTERVAL", 0))
+
+# Deletes the checkpoints older than the last `keep_last` of the next
+# `batch_size` threads after the cursor, together with the pending writes
+# attached to them. Threads are walked in primary-key order, so each batch
+# only reads the rows of its own threads, and returns the last thread as the
+# cursor of the next batch.
+PRUNE_CHECKPOINTS_SQL = """
+WITH threads AS (
+    SELECT DISTINCT thread_id, checkpoint_ns
+    FROM checkpoints
+    WHERE (thread_id, checkpoint_ns) > (%(after_thread_id)s, %(after_ns)s)
+    ORDER BY thread_id, checkpoint_ns
+    LIMIT %(batch_size)s
+), expired AS (
+    SELECT t.thread_id, t.checkpoint_ns, c.checkpoint_id
+    FROM threads t
+    CROSS JOIN LATERAL (
+        SELECT checkpoint_id
+        FROM checkpoints
+        WHERE thread_id = t.thread_id AND checkpoint_ns = t.checkpoint_ns
+        ORDER BY checkpoint_id DESC
+        OFFSET %(keep_last)s
+    ) c
+), deleted_writes AS (
+    DELETE FROM checkpoint_writes w
+    USING expired e
+    WHERE w.thread_id = e.thread_id
+        AND w.checkpoint_ns = e.checkpoint_ns
+        AND w.checkpoint_id = e.checkpoint_id
+    RETURNING pg_column_size(w.*) AS size
+), deleted_checkpoints AS (
+    DELETE FROM checkpoints c
+    USING expired e
+    WHERE c.thread_id = e.thread_id
+        AND c.checkpoint_ns = e.checkpoint_ns
+        AND c.checkpoint_id = e.checkpoint_id
+    RETURNING pg_column_size(c.*) AS size
+), last_thread AS (
+    SELECT thread_id, checkpoint_ns
+    FROM threads
+    ORDER BY thread_id DESC, checkpoint_ns DESC
+    LIMIT 1
+)
+SELECT
+    (SELECT count(*) FROM deleted_checkpoints) AS checkpoints,
+    (SELECT count(*) FROM deleted_writes) AS writes,
+    (SELECT coalesce(sum(size), 0) FROM deleted_checkpoints)
+        + (SELECT coalesce(sum(size), 0) FROM deleted_writes) AS bytes,
+    (SELECT thread_id FROM last_thread) AS last_thread_id,
+    (SELECT checkpoint_ns FROM last_thread) AS last_ns
+"""
+
+# Deletes the channel blobs of the threads in (after, last] that no remaining
+# checkpoint references. Only superseded versions are considered, so blobs
+# written by a checkpoint that is still being saved are never touched. The
+# channel versions of the remaining checkpoints are expanded once per batch.
+PRUNE_BLOBS_SQL = """
+WITH versions AS (
+    SELECT c.thread_id, c.checkpoint_ns, v.channel, v.version
+    FROM checkpoints c
+    CROSS JOIN LATERAL jsonb_each_text(c.checkpoint -> 'channel_versions')
+        AS v(channel, version)
+    WHERE (c.thread_id, c.checkpoint_ns) > (%(after_thread_id)s, %(after_ns)s)
+        AND (c.thread_id, c.checkpoint_ns) <= (%(last_thread_id)s, %(last_ns)s)
+), latest AS (
+    SELECT thread_id, checkpoint_ns, channel, max(version) AS version
+    FROM versions
+    GROUP BY thread_id, checkpoint_ns, channel
+), orphaned AS (
+    SELECT b.thread_id, b.checkpoint_ns, b.channel, b.version
+    FROM checkpoint_blobs b
+    JOIN latest l
+        ON l.thread_id = b.thread_id
+        AND l.checkpoint_ns = b.checkpoint_ns
+        AND l.channel = b.channel
+    WHERE (b.thread_id, b.checkpoint_ns) > (%(after_thread_id)s, %(after_ns)s)
+        AND (b.thread_id, b.checkpoint_ns) <= (%(last_thread_id)s, %(last_ns)s)
+        AND b.version < l.version
+        AND NOT EXISTS (
+            SELECT 1 FROM versions v
+            WHERE v.thread_id = b.thread_id
+                AND v.checkpoint_ns = b.checkpoint_ns
+                AND v.channel = b.channel
+                AND v.version = b.version
+        )
+), deleted_blobs AS (
+    DELETE FROM checkpoint_blobs b
+    USING orphaned o
+    WHERE b.thread_id = o.thread_id
+        AND b.checkpoint_ns = o.checkpoint_ns
+        AND b.channel = o.channel
+        AND b.version = o.version
+    RETURNING pg_column_size(b.*) AS size
+)
+SELECT count(*) AS blobs, coalesce(sum(size), 0) AS bytes FROM deleted_blobs
+"""
+
+
+async def prune_checkpoints(
+    pool: AsyncConnectionPool,
+    keep_last: int = CHECKPOINT_KEEP_LAST,
+    batch_size: int = CHECKPOINT_PRUNE_BATCH_SIZE,
+) -> Dict[str, int]:
+    """
+    Keep the last ``keep_last`` checkpoints of every thread and delete the rest.
+
+    Threads are pruned ``batch_size`` at a time, walking the primary key with a
+    cursor, and each batch runs in its own transaction. A run reads every row
+    once, however many batches it takes, and never holds long locks on the
+    checkpointer tables.
+
+    Returns:
+        dict: Number of deleted checkpoints, writes and blobs, and the bytes they
+        used. Disk space is returned to the OS once Postgres vacuums the tables.
+    """
+    if keep_last < 1:
+        raise ValueError("keep_last must be at least 1")
+
+    report = {"checkpoints": 0, "writes": 0, "blobs": 0, "bytes": 0}
+    params = {
+        "keep_last": keep_last,
+        "batch_size": batch_size,
+        "after_thread_id": "",
+        "after_ns": "",
+    }
+
+    async with pool.connection() as conn:
+        while True:
+            cursor = await conn.execute(PRUNE_CHECKPOINTS_SQL, params)
+            row = await cursor.fetchone()
+            if row["last_thread_id"] is None:
+                break
+            report["checkpoints"] += row["checkpoints"]
+            report["writes"] += row["writes"]
+            report["bytes"] += row["bytes"]
+
+            # Blobs are checked once the batch's checkpoints are gone
+            params["last_thread_id"] = row["last_thread_id"]
+            params["last_ns"] = row["last_ns"]
+            cursor = await conn.execute(PRUNE_BLOBS_SQL, params)
+            blobs = await cursor.fetchone()
+            report["blobs"] += blobs["blobs"]
+            report["bytes"] += blobs["bytes"]
+
+            params["after_thread_id"] = row["last_thread_id"]
+            params["after_ns"] = row["last_ns"]
+
+    metrics.increment(
+        "checkpoint_rows_pruned",
+        report["checkpoints"] + report["writes"] + report["blobs"],
+    )
+    metrics.increment("checkpoint_bytes_pruned", report["bytes"])
+    logger.info(f"Checkpoint retention finished: {report}")
+    return report
+
+
+async def run_retention_loop(
+    pool: AsyncConnectionPool, interval: float = CHECKPOINT_PRUNE_INTERVAL
+) -> None:
+    """Prune checkpoints every ``interval`` seconds until the task is cancelled."""
+    while True:
+        try:
+            await prune_checkpoints(pool)
+        except Exception as e:
+            logger.error(f"Error pruning checkpoints: {e}")
+        await asyncio.sleep(interval)
+
+
+async def _main(keep_last: int, batch_size: int) -> None:
+    pool = create_pool()
+    await open_pool(pool)
+    try:
+        report = await prune_checkpoints(pool, keep_last, batch_size)
+    finally:
+        await pool.close()
+    print(report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Delete old LangGraph checkpoints, keeping the last N per thread."
+    )
+    parser.add_argument("--keep-last", type=int, default=CHECKPOINT_KEEP_LAST)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=CHECKPOINT_PRUNE_BATCH_SIZE,
+        help="threads pruned per batch",
+    )
+    args = parser.parse_args()
+
+    asyncio.run(_main(args.keep_last, args.batch_size))
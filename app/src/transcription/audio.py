@@ -0,0 +1,104 @@
+import binascii
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, Optional, Union
+
+from dotenv import load_dotenv
+
+from app.utils.metrics import metrics
+
+load_dotenv()
+
+TRANSCRIPTION_SPILL_BYTES = int(os.getenv("TRANSCRIPTION_SPILL_BYTES", 8 * 1024 * 1024))
+
+# Base64 is decoded in chunks of whole 4-character groups
+DECODE_CHUNK_CHARS = 1 << 20
+HASH_CHUNK_BYTES = 1 << 20
+
+# The last Ogg page header is looked for in this many trailing bytes
+OGG_TAIL_BYTES = 65536
+OPUS_SAMPLE_RATE = 48000
+
+Audio = Union[bytes, BinaryIO]
+
+
+def decoded_size(base64_audio: str) -> int:
+    """Size in bytes of the decoded audio, without decoding it."""
+    padding = len(base64_audio) - len(base64_audio.rstrip("="))
+    return len(base64_audio) * 3 // 4 - padding
+
+
+def decode_audio(
+    base64_audio: str, spill_bytes: int = TRANSCRIPTION_SPILL_BYTES
+) -> Audio:
+    """
+    Decode a base64 voice note for the transcription client.
+
+    Notes up to ``spill_bytes`` are decoded straight from the webhook string
+    into a single bytes buffer of the exact size (no temporary file, no
+    intermediate copy). Larger ones are decoded chunk by chunk into a spooled
+    file that moves to disk past ``spill_bytes``, so memory stays bounded; the
+    caller closes it.
+    """
+    size = decoded_size(base64_audio)
+    metrics.observe("voice_note_bytes", size)
+    if size <= spill_bytes:
+        return binascii.a2b_base64(base64_audio)
+
+    metrics.increment("voice_notes_spilled")
+    spool = tempfile.SpooledTemporaryFile(max_size=spill_bytes, suffix=".ogg")
+    try:
+        for start in range(0, len(base64_audio), DECODE_CHUNK_CHARS):
+            chunk = base64_audio[start : start + DECODE_CHUNK_CHARS]
+            spool.write(binascii.a2b_base64(chunk))
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def audio_digest(audio: Audio) -> str:
+    """SHA-256 of the audio, reading spooled files in chunks."""
+    digest = hashlib.sha256()
+    if isinstance(audio, bytes):
+        digest.update(audio)
+    else:
+        for chunk in iter(lambda: audio.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+        audio.seek(0)
+    return digest.hexdigest()
+
+
+def ogg_duration(audio: Audio) -> Optional[float]:
+    """
+    Duration in seconds of an Ogg Opus/Vorbis note, without decoding it.
+
+    The granule position of the last Ogg page is the number of samples in the
+    stream. Returns None when the audio is not Ogg or can't be parsed.
+    """
+    if isinstance(audio, bytes):
+        head, tail = audio[:4096], audio[-OGG_TAIL_BYTES:]
+    else:
+        head = audio.read(4096)
+        audio.seek(0, os.SEEK_END)
+        audio.seek(max(audio.tell() - OGG_TAIL_BYTES, 0))
+        tail = audio.read()
+        audio.seek(0)
+
+    if not head.startswith(b"OggS"):
+        return None
+    vorbis = head.find(b"\x01vorbis")
+    if head.find(b"OpusHead") >= 0:
+        sample_rate = OPUS_SAMPLE_RATE
+    elif vorbis >= 0:
+        sample_rate = int.from_bytes(head[vorbis + 12 : vorbis + 16], "little")
+    else:
+        return None
+
+    last_page = tail.rfind(b"OggS")
+    granule = tail[last_page + 6 : last_page + 14]
+    if last_page < 0 or len(granule) < 8 or not sample_rate:
+        return None
+    return int.from_bytes(granule, "little") / sample_rate
@@ -0,0 +1,230 @@
+import asyncio
+import io
+import os
+import time
+from typing import Callable, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from groq import NOT_GIVEN, AsyncGroq
+
+from app.config.config import load_environment
+from app.src.transcription.audio import Audio, audio_digest
+from app.utils.metrics import metrics
+
+load_dotenv()
+
+TRANSCRIPTION_MODEL = os.getenv("TRANSCRIPTION_MODEL", "whisper-large-v3")
+TRANSCRIPTION_TIMEOUT = float(os.getenv("TRANSCRIPTION_TIMEOUT", 30))
+TRANSCRIPTION_CONNECT_TIMEOUT = float(os.getenv("TRANSCRIPTION_CONNECT_TIMEOUT", 5))
+TRANSCRIPTION_MAX_CONCURRENT = int(os.getenv("TRANSCRIPTION_MAX_CONCURRENT", 8))
+TRANSCRIPTION_MAX_CONNECTIONS = int(os.getenv("TRANSCRIPTION_MAX_CONNECTIONS", 20))
+TRANSCRIPTION_MAX_RETRIES = int(os.getenv("TRANSCRIPTION_MAX_RETRIES", 2))
+
+TRANSCRIPTION_LOCAL_MODEL = os.getenv("TRANSCRIPTION_LOCAL_MODEL", "small")
+TRANSCRIPTION_LOCAL_COMPUTE_TYPE = os.getenv("TRANSCRIPTION_LOCAL_COMPUTE_TYPE", "int8")
+TRANSCRIPTION_LOCAL_TIMEOUT = float(os.getenv("TRANSCRIPTION_LOCAL_TIMEOUT", 120))
+TRANSCRIPTION_LOCAL_MAX_CONCURRENT = int(
+    os.getenv("TRANSCRIPTION_LOCAL_MAX_CONCURRENT", 1)
+)
+
+TRANSCRIPTION_STUB_DELAY = float(os.getenv("TRANSCRIPTION_STUB_DELAY", 0))
+
+
+class TranscriptionBackend:
+    """
+    A speech-to-text engine with its own concurrency limit and timeout.
+
+    At most ``max_concurrent`` notes are transcribed at once, the others wait
+    for a slot without blocking the event loop, and each transcription is
+    bounded by ``timeout`` seconds. Subclasses implement ``_transcribe`` and,
+    if they hold resources, ``open``/``close``.
+    """
+
+    name = "base"
+
+    def __init__(self, model: str, max_concurrent: int, timeout: float):
+        self.model = model
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        metrics.register_gauge(
+            f"transcriptions_in_flight.{self.name}", lambda: self._in_flight
+        )
+
+    async def open(self) -> None:
+        """
+        Prepare the backend.
+
+        Raises:
+            ImportError, ValueError: If the backend can't be used here.
+        """
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+
+    async def close(self) -> None:
+        pass
+
+    def saturated(self) -> bool:
+        """True when a new note would have to wait for a slot."""
+        return self._slots is None or self._slots.locked()
+
+    async def transcribe(self, audio: Audio, language: Optional[str] = None) -> str:
+        """Transcribe a voice note and return its text."""
+        async with self._slots:
+            self._in_flight += 1
+            start = time.monotonic()
+            try:
+                text = await asyncio.wait_for(
+                    self._transcribe(audio, language), self.timeout
+                )
+            except Exception:
+                metrics.increment(f"transcription_errors.{self.name}")
+                raise
+            finally:
+                self._in_flight -= 1
+            metrics.observe(
+                f"transcription_latency.{self.name}", time.monotonic() - start
+            )
+        return text
+
+    async def _transcribe(self, audio: Audio, language: Optional[str]) -> str:
+        raise NotImplementedError
+
+
+class GroqBackend(TranscriptionBackend):
+    """
+    Whisper on the Groq API.
+
+    One ``httpx.AsyncClient`` keeps a pool of warm connections for the life of
+    the process.
+    """
+
+    name = "groq"
+
+    def __init__(
+        self,
+        model: str = TRANSCRIPTION_MODEL,
+        timeout: float = TRANSCRIPTION_TIMEOUT,
+        connect_timeout: float = TRANSCRIPTION_CONNECT_TIMEOUT,
+        max_concurrent: int = TRANSCRIPTION_MAX_CONCURRENT,
+        max_connections: int = TRANSCRIPTION_MAX_CONNECTIONS,
+        max_retries: int = TRANSCRIPTION_MAX_RETRIES,
+    ):
+        super().__init__(model, max_concurrent, timeout)
+        self.http_timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self._http: Optional[httpx.AsyncClient] = None
+        self._client: Optional[AsyncGroq] = None
+
+    async def open(self) -> None:
+        env = load_environment(["GROQ_API_KEY"])
+        await super().open()
+        self._http = httpx.AsyncClient(
+            timeout=self.http_timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+        )
+        self._client = AsyncGroq(
+            api_key=env["GROQ_API_KEY"],
+            http_client=self._http,
+            timeout=self.http_timeout,
+            max_retries=self.max_retries,
+        )
+
+    async def close(self) -> None:
+        if self._http:
+            await self._http.aclose()
+        self._http = self._client = None
+
+    async def _transcribe(self, audio, language):
+        transcription = await self._client.audio.transcriptions.create(
+            model=self.model,
+            file=("audio.ogg", audio),
+            language=language or NOT_GIVEN,
+        )
+        return transcription.text
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """
+    Whisper on the local CPU with faster-whisper (optional dependency).
+
+    The model is loaded once at startup and runs in a worker thread. A
+    transcription that times out is abandoned, but its thread keeps the CPU
+    until it finishes, so keep ``max_concurrent`` at or below the cores to spare.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        model: str = TRANSCRIPTION_LOCAL_MODEL,
+        compute_type: str = TRANSCRIPTION_LOCAL_COMPUTE_TYPE,
+        timeout: float = TRANSCRIPTION_LOCAL_TIMEOUT,
+        max_concurrent: int = TRANSCRIPTION_LOCAL_MAX_CONCURRENT,
+    ):
+        super().__init__(model, max_concurrent, timeout)
+        self.compute_type = compute_type
+        self._model = None
+
+    async def open(self) -> None:
+        from faster_whisper import WhisperModel
+
+        await super().open()
+        self._model = await asyncio.to_thread(
+            WhisperModel, self.model, device="cpu", compute_type=self.compute_type
+        )
+
+    def _run(self, audio: Audio, language: Optional[str]) -> str:
+        source = io.BytesIO(audio) if isinstance(audio, bytes) else audio
+        segments, _ = self._model.transcribe(source, language=language)
+        return "".join(segment.text for segment in segments).strip()
+
+    async def _transcribe(self, audio, language):
+        return await asyncio.to_thread(self._run, audio, language)
+
+
+class StubBackend(TranscriptionBackend):
+    """
+    Offline backend for tests and benchmarks: the same audio always gives the
+    same text, after ``delay`` seconds.
+    """
+
+    name = "stub"
+
+    def __init__(
+        self,
+        delay: float = TRANSCRIPTION_STUB_DELAY,
+        max_concurrent: int = TRANSCRIPTION_MAX_CONCURRENT,
+        timeout: float = TRANSCRIPTION_TIMEOUT,
+    ):
+        super().__init__("stub", max_concurrent, timeout)
+        self.delay = delay
+
+    async def _transcribe(self, audio, language):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return f"Voice note {audio_digest(audio)[:12]}"
+
+
+BACKENDS: Dict[str, Callable[[], TranscriptionBackend]] = {
+    "groq": GroqBackend,
+    "local": LocalWhisperBackend,
+    "stub": StubBackend,
+}
+
+
+def register_backend(name: str, factory: Callable[[], TranscriptionBackend]) -> None:
+    """Register a transcription backend factory under a name."""
+    BACKENDS[name] = factory
+
+
+def create_backend(name: str) -> TranscriptionBackend:
+    """Create the transcription backend registered as ``name``."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown transcription backend: {name}")
+    return BACKENDS[name]()
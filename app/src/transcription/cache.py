@@ -0,0 +1,217 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from app.config.logging import logger
+from app.src.transcription.audio import Audio, audio_digest
+from app.utils.metrics import metrics
+
+load_dotenv()
+
+TRANSCRIPTION_CACHE_ENABLED = (
+    os.getenv("TRANSCRIPTION_CACHE_ENABLED", "true").lower() == "true"
+)
+TRANSCRIPTION_CACHE_TTL = float(os.getenv("TRANSCRIPTION_CACHE_TTL", 7 * 86400))
+TRANSCRIPTION_CACHE_MAX_ENTRIES = int(
+    os.getenv("TRANSCRIPTION_CACHE_MAX_ENTRIES", 5000)
+)
+# Empty keeps the cache in memory only
+TRANSCRIPTION_CACHE_PATH = os.getenv("TRANSCRIPTION_CACHE_PATH", "")
+TRANSCRIPTION_CACHE_DISK_MAX_ENTRIES = int(
+    os.getenv("TRANSCRIPTION_CACHE_DISK_MAX_ENTRIES", 100000)
+)
+TRANSCRIPTION_CACHE_PRUNE_INTERVAL = float(
+    os.getenv("TRANSCRIPTION_CACHE_PRUNE_INTERVAL", 3600)
+)
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS transcriptions (
+    key TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    expires_at REAL NOT NULL
+)
+"""
+
+CREATE_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS transcriptions_expires_at ON transcriptions (expires_at)
+"""
+
+# Entries are written with the same ttl, the first to expire are the oldest
+TRIM_SQL = """
+DELETE FROM transcriptions WHERE key IN (
+    SELECT key FROM transcriptions ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+)
+"""
+
+
+def audio_key(audio: Audio, language: Optional[str], model: str) -> str:
+    """Content address of a voice note: SHA-256 of the audio, language and model."""
+    return f"{model}:{language or ''}:{audio_digest(audio)}"
+
+
+class TranscriptionCache:
+    """
+    Transcripts of voice notes keyed by the content of the audio.
+
+    Forwarded notes and webhook retries carry the same bytes, so they are
+    transcribed once. Entries live in an LRU of ``max_entries`` and, when
+    ``path`` is set, in a SQLite file shared by the workers of the host and
+    kept across restarts. Both tiers expire entries after ``ttl`` seconds; the
+    SQLite file is pruned every ``prune_interval`` seconds, down to its
+    ``disk_max_entries`` most recent entries. Concurrent misses on the same key
+    share one transcription.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = TRANSCRIPTION_CACHE_MAX_ENTRIES,
+        ttl: float = TRANSCRIPTION_CACHE_TTL,
+        path: str = TRANSCRIPTION_CACHE_PATH,
+        disk_max_entries: int = TRANSCRIPTION_CACHE_DISK_MAX_ENTRIES,
+        prune_interval: float = TRANSCRIPTION_CACHE_PRUNE_INTERVAL,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.disk_max_entries = disk_max_entries
+        self.prune_interval = prune_interval
+        self._next_prune = 0.0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._lookups = 0
+        metrics.register_gauge(
+            "transcription_cache_entries", lambda: len(self._entries)
+        )
+        metrics.register_gauge(
+            "transcription_cache_hit_rate",
+            lambda: self._hits / self._lookups if self._lookups else 0.0,
+        )
+
+    async def open(self) -> None:
+        """Open the persistent tier, if any, and prune it."""
+        if self.path:
+            await asyncio.to_thread(self._open)
+
+    async def close(self) -> None:
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    async def fetch(self, key: str, transcribe: Callable[[], Awaitable[str]]) -> str:
+        """Return the cached transcript of ``key``, transcribing it on a miss."""
+        text = await self.get(key)
+        if text is not None:
+            return text
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            # The same note is already being transcribed
+            self._hits += 1
+            metrics.increment("transcription_cache_hits.pending")
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            text = await transcribe()
+            await self.set(key, text)
+            future.set_result(text)
+            return text
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting for it
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    async def get(self, key: str) -> Optional[str]:
+        self._lookups += 1
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] >= time.time():
+            self._entries.move_to_end(key)
+            self._hits += 1
+            metrics.increment("transcription_cache_hits.memory")
+            return entry[1]
+        self._entries.pop(key, None)
+
+        if self._conn:
+            row = await asyncio.to_thread(self._get, key)
+            if row is not None:
+                self._remember(key, row[1], row[0])
+                self._hits += 1
+                metrics.increment("transcription_cache_hits.disk")
+                return row[1]
+
+        metrics.increment("transcription_cache_misses")
+        return None
+
+    async def set(self, key: str, text: str) -> None:
+        expires_at = time.time() + self.ttl
+        self._remember(key, text, expires_at)
+        if self._conn:
+            try:
+                await asyncio.to_thread(self._set, key, text, expires_at)
+            except sqlite3.Error as e:
+                logger.error(f"Error writing the transcription cache: {e}")
+
+    def _remember(self, key: str, text: str, expires_at: float) -> None:
+        self._entries[key] = (expires_at, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _open(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(CREATE_TABLE_SQL)
+        conn.execute(CREATE_INDEX_SQL)
+        self._conn = conn
+        with self._lock:
+            self._prune()
+
+    def _prune(self) -> None:
+        """Drop the expired entries, then the oldest ones beyond the bound."""
+        expired = self._conn.execute(
+            "DELETE FROM transcriptions WHERE expires_at < ?", (time.time(),)
+        ).rowcount
+        trimmed = self._conn.execute(TRIM_SQL, (self.disk_max_entries,)).rowcount
+        if expired or trimmed:
+            logger.info(
+                f"Pruned the transcription cache: {expired} expired, "
+                f"{trimmed} over {self.disk_max_entries} entries"
+            )
+        self._next_prune = time.monotonic() + self.prune_interval
+
+    def _get(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT expires_at, text FROM transcriptions "
+                "WHERE key = ? AND expires_at >= ?",
+                (key, time.time()),
+            ).fetchone()
+
+    def _set(self, key: str, text: str, expires_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO transcriptions (key, text, expires_at) "
+                "VALUES (?, ?, ?)",
+                (key, text, expires_at),
+            )
+            if time.monotonic() >= self._next_prune:
+                self._prune()
@@ -0,0 +1,152 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.config.logging import logger
+from app.src.transcription.audio import Audio, ogg_duration
+from app.src.transcription.backends import TranscriptionBackend, create_backend
+from app.utils.metrics import metrics
+
+load_dotenv()
+
+TRANSCRIPTION_ROUTES = os.getenv("TRANSCRIPTION_ROUTES", "default:groq")
+TRANSCRIPTION_FALLBACK_BACKEND = os.getenv("TRANSCRIPTION_FALLBACK_BACKEND", "")
+
+DURATION_CONDITION = re.compile(r"^duration(<=|>=|<|>)(\d+(?:\.\d+)?)$")
+
+
+def parse_routes(routes: str) -> List[Tuple[str, str]]:
+    """
+    Parse ``"duration<15:local,language=en:groq,default:groq"`` into
+    ``[(condition, backend), ...]``.
+    """
+    parsed = []
+    for item in routes.split(","):
+        condition, _, backend = item.strip().rpartition(":")
+        if not (
+            condition == "default"
+            or condition.startswith("language=")
+            or DURATION_CONDITION.match(condition)
+        ):
+            raise ValueError(f"Unknown transcription route condition: {condition}")
+        parsed.append((condition, backend))
+    return parsed
+
+
+def route_matches(
+    condition: str, duration: Optional[float], language: Optional[str]
+) -> bool:
+    if condition == "default":
+        return True
+    if condition.startswith("language="):
+        return condition[len("language=") :] == language
+    if duration is None:
+        return False
+    operator, seconds = DURATION_CONDITION.match(condition).groups()
+    seconds = float(seconds)
+    return {
+        "<": duration < seconds,
+        "<=": duration <= seconds,
+        ">": duration > seconds,
+        ">=": duration >= seconds,
+    }[operator]
+
+
+class TranscriptionClient:
+    """
+    Transcribe voice notes on the backends picked by ``routes``.
+
+    Routes are tried in order and the first one whose condition matches and
+    whose backend is available wins: ``duration<N``/``duration>=N`` (seconds,
+    read from the Ogg container), ``language=xx`` or ``default``. The
+    ``fallback`` backend takes a note when the routed backend has no free slot
+    (e.g. move load off the API during bursts) or fails.
+
+    Backends that can't be opened (missing API key or optional dependency)
+    are skipped with a warning. Open the client once at startup and close it
+    on shutdown.
+    """
+
+    def __init__(
+        self,
+        routes: str = TRANSCRIPTION_ROUTES,
+        fallback: str = TRANSCRIPTION_FALLBACK_BACKEND,
+    ):
+        self.routes = parse_routes(routes)
+        self.fallback = fallback or None
+        self.backends: Dict[str, TranscriptionBackend] = {}
+
+    async def open(self) -> None:
+        """Open every backend used by the routes or as fallback."""
+        names = [backend for _, backend in self.routes] + [self.fallback]
+        for name in dict.fromkeys(name for name in names if name):
+            try:
+                backend = create_backend(name)
+                await backend.open()
+            except (ImportError, ValueError) as e:
+                logger.warning(f"Transcription backend {name} unavailable: {e}")
+                continue
+            self.backends[name] = backend
+        if not self.backends:
+            logger.warning("Voice notes can't be transcribed: no backend available")
+
+    @property
+    def model(self) -> str:
+        """
+        The models of every open backend, for cache keys.
+
+        It doesn't depend on the backend a note is routed to, which changes
+        with load (overflow) and failures (fallback).
+        """
+        return ",".join(
+            f"{name}={backend.model}" for name, backend in sorted(self.backends.items())
+        )
+
+    async def close(self) -> None:
+        for backend in self.backends.values():
+            await backend.close()
+        self.backends = {}
+
+    def route(
+        self, audio: Audio, language: Optional[str] = None
+    ) -> Optional[TranscriptionBackend]:
+        """Pick the backend for a voice note, None if none is available."""
+        duration = None
+        if any(condition.startswith("duration") for condition, _ in self.routes):
+            duration = ogg_duration(audio)
+
+        backend = None
+        for condition, name in self.routes:
+            if name in self.backends and route_matches(condition, duration, language):
+                backend = self.backends[name]
+                break
+
+        fallback = self.backends.get(self.fallback)
+        if backend is None:
+            return fallback
+        if backend.saturated() and fallback and not fallback.saturated():
+            metrics.increment("transcription_overflows")
+            return fallback
+        return backend
+
+    async def transcribe(self, audio: Audio, language: Optional[str] = None) -> str:
+        """Transcribe a voice note on the backend it is routed to."""
+        backend = self.route(audio, language)
+        if backend is None:
+            raise RuntimeError("No transcription backend available")
+        try:
+            return await backend.transcribe(audio, language)
+        except Exception as e:
+            fallback = self.backends.get(self.fallback)
+            if fallback is None or fallback is backend:
+                raise
+            logger.warning(
+                f"Transcription on {backend.name} failed, "
+                f"retrying on {fallback.name}: {e}"
+            )
+            metrics.increment("transcription_fallbacks")
+            if not isinstance(audio, bytes):
+                audio.seek(0)
+            return await fallback.transcribe(audio, language)
@@ -10,7 +10,7 @@ from langchain_core.runnables.graph import CurveStyle, MermaidDrawMethod, NodeSt
 from langgraph.graph import StateGraph
 from rich.console import Console
 
-from app.src.wppconnect.api import send_voice
+from app.src.wppconnect.api import send_message, send_voice
 
 rich = Console()
 
@@ -44,12 +44,14 @@ def generate_thread_id(user_id: str) -> str:
     return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"thread-{user_id}"))
 
 
-def process_chunks(chunk, phone_number):
+def process_chunks(chunk, phone_number, text_only=False):
     """
     Processes a chunk from the agent and displays information about agent's answer.
 
     Parameters:
         chunk (dict): A dictionary containing information about the agent's messages.
+        phone_number (str): The user to send the answer to.
+        text_only (bool): Send the answer as text instead of a voice message.
 
     Returns:
         None
@@ -58,8 +60,10 @@ def process_chunks(chunk, phone_number):
     It extracts and prints the agent's answer using the Rich library.
     """
     if isinstance(chunk, dict):
-        if "messages" in chunk[list(chunk.keys())[0]]:
-            message = chunk[list(chunk.keys())[0]]["messages"]
+        update = chunk[list(chunk.keys())[0]]
+        # Nodes that change nothing (e.g. the summarizer) emit a None update
+        if isinstance(update, dict) and "messages" in update:
+            message = update["messages"]
 
             if isinstance(message, AIMessage):
                 agent_answer = message.content
@@ -68,18 +72,24 @@ def process_chunks(chunk, phone_number):
                         rich.print(f"\nAgent:\n{answer}", style="black on white")
 
                 if isinstance(agent_answer, str):
-                    agent_answer = message.content
-                    rich.print(
-                        f"\nAgent:\n{agent_answer}",
-                        style="black on white",
-                    )
+                    send_reply(agent_answer, phone_number, text_only)
 
-                    tts = gTTS(text=agent_answer, lang=GTTS_LANG)
 
-                    with tempfile.NamedTemporaryFile(
-                        delete=False, suffix=".mp3"
-                    ) as temp_audio:
-                        audio_path = temp_audio.name
-                        tts.save(audio_path)
+def send_reply(text: str, phone_number: str, text_only: bool = False) -> None:
+    """Print the agent's answer and send it to the user as a voice (or text) message."""
+    rich.print(
+        f"\nAgent:\n{text}",
+        style="black on white",
+    )
+
+    if text_only:
+        send_message(text, phone_number)
+        return
+
+    tts = gTTS(text=text, lang=GTTS_LANG)
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_audio:
+        audio_path = temp_audio.name
+        tts.save(audio_path)
 
-                    send_voice(audio_path, phone_number)
+    send_voice(audio_path, phone_number)
@@ -0,0 +1,41 @@
+from collections import defaultdict
+from typing import Callable, Dict
+
+
+class Metrics:
+    """In-process counters and gauges served at ``GET /metrics``."""
+
+    def __init__(self):
+        self._counters = defaultdict(int)
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+
+    def increment(self, name: str, value: int = 1) -> None:
+        """Increase the counter ``name`` by ``value``."""
+        self._counters[name] += value
+
+    def register_gauge(self, name: str, callback: Callable[[], float]) -> None:
+        """Register a gauge whose value is read from ``callback`` on every snapshot."""
+        self._gauges[name] = callback
+
+    def observe(self, name: str, value: float) -> None:
+        """Record a sample (e.g. a duration in seconds) of the timing ``name``."""
+        timing = self._timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        timing["count"] += 1
+        timing["total"] += value
+        timing["max"] = max(timing["max"], value)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Return the current value of every counter, gauge and timing."""
+        return {
+            "counters": dict(self._counters),
+            "gauges": {name: callback() for name, callback in self._gauges.items()},
+            "timings": {
+                name: {**timing, "avg": timing["total"] / timing["count"]}
+                for name, timing in self._timings.items()
+            },
+        }
+
+
+# Create default metrics registry
+metrics = Metrics()
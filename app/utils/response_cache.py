@@ -0,0 +1,113 @@
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from dotenv import load_dotenv
+
+from app.utils.metrics import metrics
+
+load_dotenv()
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000))
+RESPONSE_CACHE_MAX_CHARS = int(os.getenv("RESPONSE_CACHE_MAX_CHARS", 20))
+
+# Only these messages (normalized) and emoji-only messages are ever cached:
+# greetings, acknowledgements and thanks carry nothing about the sender
+RESPONSE_CACHE_MESSAGES = os.getenv(
+    "RESPONSE_CACHE_MESSAGES",
+    "hi,hello,hey,hi there,good morning,good afternoon,good evening,"
+    "ok,okay,k,sure,got it,alright,cool,thanks,thank you,thx,ty,"
+    "oi,olá,ola,bom dia,boa tarde,boa noite,certo,beleza,obrigado,obrigada,valeu",
+)
+
+# Unicode categories an emoji-only message is made of (symbols, skin tone
+# modifiers, variation selectors, zero-width joiners and spaces)
+EMOJI_CATEGORIES = {"So", "Sk", "Mn", "Cf", "Zs"}
+
+
+def normalize_message(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation ("Thanks!!" -> "thanks")."""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(".!?,;: ") or text
+
+
+def is_emoji_only(text: str) -> bool:
+    """True for messages made only of emoji ("👍", "🙏🏽", "❤️")."""
+    categories = {unicodedata.category(char) for char in text}
+    return "So" in categories and categories <= EMOJI_CATEGORIES
+
+
+class ResponseCache:
+    """
+    LRU cache of replies to trivial, high-frequency messages ("hi", "ok", "thanks"...).
+
+    Only messages in ``messages`` and emoji-only messages up to ``max_chars``
+    are cached; anything else may carry something the reply must answer.
+    Entries are keyed by the normalized message plus a fingerprint of the model
+    and prompt, and expire after ``ttl`` seconds. Threads can opt out individually.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_chars: int = RESPONSE_CACHE_MAX_CHARS,
+        messages: Iterable[str] = RESPONSE_CACHE_MESSAGES.split(","),
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self.messages = {normalize_message(m) for m in messages if m.strip()}
+        self._entries = OrderedDict()
+        self._opted_out = set()
+        metrics.register_gauge("response_cache_entries", lambda: len(self._entries))
+
+    def opt_out(self, thread_id: str) -> None:
+        """Never serve or store cached replies for ``thread_id``."""
+        self._opted_out.add(thread_id)
+
+    def opt_in(self, thread_id: str) -> None:
+        self._opted_out.discard(thread_id)
+
+    def is_enabled(self, thread_id: Optional[str]) -> bool:
+        return thread_id not in self._opted_out
+
+    def key(self, message: str, fingerprint: str) -> Optional[str]:
+        """Return the cache key of ``message``, or None if it is not cacheable."""
+        normalized = normalize_message(message)
+        if not self.is_trivial(normalized):
+            return None
+        return f"{fingerprint}:{normalized}"
+
+    def is_trivial(self, normalized: str) -> bool:
+        if normalized in self.messages:
+            return True
+        return len(normalized) <= self.max_chars and is_emoji_only(normalized)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            metrics.increment("response_cache_misses")
+            return None
+        self._entries.move_to_end(key)
+        metrics.increment("response_cache_hits")
+        return entry[1]
+
+    def set(self, key: str, reply: str) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# Create default response cache instance
+response_cache = ResponseCache()
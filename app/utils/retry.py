@@ -0,0 +1,51 @@
+import os
+import random
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class RetryPolicy:
+    """
+    Bounded retry policy with exponential backoff and jitter.
+
+    Parameters:
+        max_attempts (int): Total number of attempts, including the first one.
+        backoff (float): Delay in seconds before the second attempt.
+        max_backoff (float): Upper bound for the exponential delay.
+        jitter (float): Random extra delay, as a fraction of the computed delay.
+        deadline (float): Overall time budget in seconds for all attempts.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 4.0,
+        jitter: float = 0.5,
+        deadline: float = 30.0,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """Build the policy from the ``LLM_RETRY_*`` environment variables."""
+        return cls(
+            max_attempts=int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", 3)),
+            backoff=float(os.getenv("LLM_RETRY_BACKOFF", 0.5)),
+            max_backoff=float(os.getenv("LLM_RETRY_MAX_BACKOFF", 4.0)),
+            jitter=float(os.getenv("LLM_RETRY_JITTER", 0.5)),
+            deadline=float(os.getenv("LLM_TURN_DEADLINE", 30.0)),
+        )
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after the failed ``attempt`` (1-based)."""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay + random.uniform(0, delay * self.jitter)
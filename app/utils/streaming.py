@@ -0,0 +1,145 @@
+import asyncio
+import os
+import re
+from typing import Any, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableConfig, ensure_config
+from langgraph.graph.state import CompiledStateGraph
+
+from app.utils.graph_utils import send_reply
+from app.utils.tokens import message_text
+
+load_dotenv()
+
+STREAM_MIN_SEGMENT_CHARS = int(os.getenv("STREAM_MIN_SEGMENT_CHARS", 40))
+
+# End of a sentence: terminal punctuation (or a line break) followed by whitespace
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+class SentenceSplitter:
+    """
+    Accumulate streamed tokens and cut them into complete sentences.
+
+    Segments shorter than ``min_chars`` are merged with the following sentence,
+    so abbreviations and short interjections don't become separate messages.
+    """
+
+    def __init__(self, min_chars: int = STREAM_MIN_SEGMENT_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Add streamed text and return the sentences completed by it."""
+        self._buffer += text
+        segments = []
+        start = 0
+        for boundary in SENTENCE_BOUNDARY.finditer(self._buffer):
+            segment = self._buffer[start : boundary.start()].strip()
+            if len(segment) >= self.min_chars:
+                segments.append(segment)
+                start = boundary.end()
+        self._buffer = self._buffer[start:]
+        return segments
+
+    def reset(self) -> None:
+        """Drop the unfinished sentence, e.g. when its generation was abandoned."""
+        self._buffer = ""
+
+    def flush(self) -> Optional[str]:
+        """Return whatever text is left once the stream is over."""
+        segment = self._buffer.strip()
+        self._buffer = ""
+        return segment or None
+
+
+class FirstTokenWatcher(AsyncCallbackHandler):
+    """
+    Notice when a chat model streams its first token.
+
+    From then on part of the answer may already be on its way to the user, so
+    the generation must not be started over (deadline fallback, failover).
+    """
+
+    def __init__(self):
+        self.streamed = asyncio.Event()
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if token:
+            self.streamed.set()
+
+    def watch(self, config: Optional[RunnableConfig]) -> RunnableConfig:
+        """Return a copy of ``config`` passing the model runs to this handler."""
+        config = ensure_config(config)
+        callbacks = config.get("callbacks")
+        if callbacks is None:
+            callbacks = [self]
+        elif isinstance(callbacks, list):
+            callbacks = [*callbacks, self]
+        else:
+            callbacks = callbacks.copy()
+            callbacks.add_handler(self, inherit=True)
+        return {**config, "callbacks": callbacks}
+
+
+async def stream_reply(
+    graph: CompiledStateGraph,
+    input_data: dict,
+    config: dict,
+    phone_number: str,
+    text_only: bool = False,
+) -> None:
+    """
+    Run the graph with token streaming and send the answer sentence by sentence.
+
+    Each sentence is dispatched to WPPConnect as soon as it is complete, while
+    the model keeps generating the rest of the answer.
+
+    The assistant only starts over before anything was streamed: the turn
+    deadline and provider failover stop applying at the first token. A new
+    message id (empty-output retry) still drops the unfinished sentence of the
+    abandoned generation instead of gluing it to the new one.
+    """
+    splitter = SentenceSplitter()
+    segments = asyncio.Queue()
+    sender = asyncio.create_task(_send_segments(segments, phone_number, text_only))
+    message_id = None
+
+    try:
+        async for message, metadata in graph.astream(
+            input=input_data, config=config, stream_mode="messages"
+        ):
+            # Only the assistant talks to the user, skip the summarizer tokens
+            if metadata.get("langgraph_node") != "assistant":
+                continue
+            if not isinstance(message, AIMessage):
+                continue
+            if message.id != message_id:
+                if message_id is not None:
+                    splitter.reset()
+                message_id = message.id
+            for segment in splitter.feed(message_text(message)):
+                segments.put_nowait(segment)
+
+        segment = splitter.flush()
+        if segment:
+            segments.put_nowait(segment)
+        segments.put_nowait(None)
+        await sender
+    except BaseException:
+        sender.cancel()
+        raise
+
+
+async def _send_segments(
+    segments: asyncio.Queue, phone_number: str, text_only: bool
+) -> None:
+    """Send the queued segments in order until the end marker is received."""
+    while True:
+        segment = await segments.get()
+        if segment is None:
+            return
+        await asyncio.to_thread(send_reply, segment, phone_number, text_only)
@@ -0,0 +1,81 @@
+from typing import Dict, List, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage
+
+# Rough average for English/Portuguese text with BPE tokenizers
+CHARS_PER_TOKEN = 4
+
+# Role and separator tokens added by the chat template for every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def message_text(message: BaseMessage) -> str:
+    """Return the text of a message, joining the parts of multi-part content."""
+    content = message.content
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") if isinstance(part, dict) else str(part)
+            for part in content
+        )
+    return content
+
+
+def estimate_tokens(message: BaseMessage) -> int:
+    """Approximate the number of prompt tokens used by a message."""
+    return len(message_text(message)) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def merge_token_counts(
+    left: Optional[Dict[str, int]], right: Optional[Dict[str, int]]
+) -> Dict[str, int]:
+    """
+    Reducer for the cached per-message token counts kept in the graph state.
+
+    New counts are merged by message id; an id mapped to ``None`` is dropped,
+    which is how removed messages are evicted from the cache.
+    """
+    merged = {**(left or {}), **(right or {})}
+    return {id: count for id, count in merged.items() if count is not None}
+
+
+def count_new_tokens(
+    messages: List[BaseMessage], token_counts: Dict[str, int]
+) -> Dict[str, int]:
+    """Count the tokens of the messages that are not cached yet."""
+    return {
+        message.id: estimate_tokens(message)
+        for message in messages
+        if message.id not in token_counts
+    }
+
+
+def total_tokens(messages: List[BaseMessage], token_counts: Dict[str, int]) -> int:
+    """Sum the token counts of messages, estimating the ones that are not cached."""
+    return sum(
+        token_counts.get(message.id) or estimate_tokens(message) for message in messages
+    )
+
+
+def select_context_window(
+    messages: List[BaseMessage], token_counts: Dict[str, int], budget: int
+) -> List[BaseMessage]:
+    """
+    Select the most recent messages that fit in ``budget`` tokens.
+
+    The latest message is always kept, and the window starts on a user message
+    so the model never sees an answer without its question.
+    """
+    window = []
+    used = 0
+    for message in reversed(messages):
+        count = token_counts.get(message.id) or estimate_tokens(message)
+        if window and used + count > budget:
+            break
+        window.append(message)
+        used += count
+    window.reverse()
+
+    start = 0
+    while start < len(window) - 1 and not isinstance(window[start], HumanMessage):
+        start += 1
+    return window[start:]
@@ -1,29 +1,43 @@
 import asyncio
-import base64
 import os
-import tempfile
-from collections import defaultdict
+import time
 from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 
-from app.agent import main
+from app.agent import ERROR_REPLY, create_checkpointer, graph_cache, main
 from app.config.logging import setup_logger
+from app.messaging.admission import AGENT_SHED_REPLY, AdmissionController, TurnShedError
+from app.messaging.aggregator import MessageAggregator
+from app.messaging.conversation import ConversationRunner, create_turn_lock
+from app.messaging.journal import MESSAGE_JOURNAL_ENABLED, MessageJournal
+from app.messaging.store import AGGREGATION_STORE, Entry, create_aggregation_store
+from app.messaging.transcripts import BackgroundTranscriber
+from app.messaging.workers import AGENT_WORKERS, AgentWorkerPool
+from app.src.postgres.pool import create_pool, get_pool_stats, open_pool
+from app.src.postgres.retention import CHECKPOINT_PRUNE_INTERVAL, run_retention_loop
+from app.src.transcription.audio import decode_audio
+from app.src.transcription.cache import (
+    TRANSCRIPTION_CACHE_ENABLED,
+    TranscriptionCache,
+    audio_key,
+)
+from app.src.transcription.client import TranscriptionClient
+from app.src.wppconnect.api import send_message
+from app.utils.graph_utils import generate_thread_id
+from app.utils.metrics import metrics
 
 load_dotenv()
 
-WAIT_TIME = os.getenv("WAIT_TIME", 1)
 LANG = os.getenv("LANGUAGE")
+AGENT_DRAIN_TIMEOUT = float(os.getenv("AGENT_DRAIN_TIMEOUT", 25))
 
 logger = setup_logger()
 
-message_buffers = defaultdict(list)
-processing_tasks = {}
-
 
 class Sender(BaseModel):
     """Simplified sender information"""
@@ -45,88 +59,225 @@ class WebhookMessage(BaseModel):
 
 
 async def transcribe_base64_audio(base64_audio: str) -> str:
-    """Transcribe audio from base64 data using OpenAI Whisper"""
+    """Transcribe audio from base64 data using Whisper"""
+    audio = decode_audio(base64_audio)
     try:
-        # Decode base64 audio data
-        audio_data = base64.b64decode(base64_audio)
-
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".ogg") as tmp_file:
-            tmp_file.write(audio_data)
-            tmp_file_path = tmp_file.name
-
-        # Transcribe the audio
-        with open(tmp_file_path, "rb") as audio_file:
-            transcription = GROQ_CLIENT.audio.transcriptions.create(
-                model="whisper-large-v3", file=audio_file, language=LANG
-            )
-        return transcription.text
+        if transcription_cache is None:
+            return await transcription.transcribe(audio, LANG)
+        # Forwarded notes and retries carry the same audio, transcribe it once
+        key = audio_key(audio, LANG, transcription.model)
+        return await transcription_cache.fetch(
+            key, lambda: transcription.transcribe(audio, LANG)
+        )
     finally:
-        # Clean up temporary file
-        if os.path.exists(tmp_file_path):
-            os.unlink(tmp_file_path)
+        # Large notes are spooled, release the file
+        if not isinstance(audio, bytes):
+            audio.close()
+
+
+async def run_agent(phone_number: str, message: str, text_only: bool):
+    """Run the agent, holding the conversation so no other worker runs it meanwhile"""
+    async with app.state.turn_lock.hold(generate_thread_id(phone_number)):
+        return await main(phone_number, message, app.state.checkpointer, text_only)
 
 
 async def process_aggregated_messages(
-    sender_id: str, session: str, is_user: bool, is_group: bool
+    sender_id: str, messages: List[Entry], context: dict
 ):
-    """Process messages after waiting period"""
+    """Run the agent on the messages of a sender once their aggregation window closes"""
     try:
-        # Wait for X seconds to aggregate messages
-        await asyncio.sleep(int(WAIT_TIME))
-
-        # Get all messages for this sender
-        messages = message_buffers[sender_id]
-        if not messages:
-            return
-
         # Combine all messages
-        combined_message = " ".join([msg for msg in messages])
-
-        # Clear the buffer
-        message_buffers[sender_id] = []
-
-        # Remove the task from processing_tasks
-        if sender_id in processing_tasks:
-            del processing_tasks[sender_id]
+        combined_message = " ".join([msg["text"] for msg in messages])
 
         # Process the combined message
         phone_number = sender_id.split("@")[0]
+        kind = "voice" if any(msg.get("type") == "ptt" for msg in messages) else "text"
 
         logger.info(
             f"Processing aggregated messages for {sender_id}: {combined_message}"
         )
-        agent_response = await main(phone_number, combined_message)
+        try:
+            agent_response = await admission.run(
+                lambda text_only: run_agent(phone_number, combined_message, text_only),
+                sender_id,
+                kind,
+            )
+        except TurnShedError:
+            # Overloaded: answer politely instead of queueing an LLM call
+            await asyncio.to_thread(send_message, AGENT_SHED_REPLY, phone_number)
+            return {"status": "shed", "sender_id": sender_id}
 
         logger.info(f"Agent response for aggregated messages: {agent_response}")
 
         return {
             "status": "success",
             "processed_data": {
-                "session": session,
+                "session": context["session"],
                 "message": combined_message,
                 "sender_id": sender_id,
-                "is_user": is_user,
-                "is_group": is_group,
+                "is_user": context["is_user"],
+                "is_group": context["is_group"],
             },
             "agent_response": agent_response,
         }
 
     except Exception as e:
         logger.error(f"Error processing aggregated messages: {str(e)}")
-        # Clear the buffer in case of error
-        message_buffers[sender_id] = []
-        if sender_id in processing_tasks:
-            del processing_tasks[sender_id]
         raise
 
 
+async def complete_turn(sender_id: str, messages: List[Entry]):
+    """The turn is over, don't replay its messages after a restart"""
+    if journal:
+        await journal.mark_processed(
+            [msg["journal_id"] for msg in messages if msg.get("journal_id")]
+        )
+
+
+async def abandon_turn(sender_id: str, messages: List[Entry]):
+    """The turn kept crashing its worker, apologize instead of replaying it"""
+    await asyncio.to_thread(send_message, ERROR_REPLY, sender_id.split("@")[0])
+    await complete_turn(sender_id, messages)
+
+
+async def run_turn(sender_id: str, messages: List[Entry], context: dict):
+    """Run a turn in this process"""
+    await process_aggregated_messages(sender_id, messages, context)
+    await complete_turn(sender_id, messages)
+
+
+@asynccontextmanager
+async def agent_resources():
+    """Open what agent turns need: the Postgres pool, the checkpointer and the graph"""
+    pool = create_pool()
+    await open_pool(pool)
+    app.state.pool = pool
+    app.state.checkpointer = create_checkpointer(pool)
+    app.state.turn_lock = create_turn_lock()
+    await app.state.turn_lock.open()
+    graph_cache.get(app.state.checkpointer)
+    try:
+        yield pool
+    finally:
+        await app.state.turn_lock.close()
+        await pool.close()
+
+
+# Shared by every webhook, opened in lifespan
+transcription = TranscriptionClient()
+transcription_cache = TranscriptionCache() if TRANSCRIPTION_CACHE_ENABLED else None
+
+# Turns of a conversation run one at a time, different senders run in parallel
+# up to the global admission limit
+admission = AdmissionController()
+conversations = ConversationRunner(run_turn)
+
+# With AGENT_WORKERS > 0 this process only ingests messages, turns run in a pool
+# of worker processes partitioned by sender
+agent_workers = (
+    AgentWorkerPool(
+        AGENT_WORKERS,
+        agent_resources,
+        process_aggregated_messages,
+        complete_turn,
+        on_abandoned=abandon_turn,
+    )
+    if AGENT_WORKERS > 0
+    else None
+)
+submit_turn = agent_workers.submit if agent_workers else conversations.submit
+
+# Voice notes are transcribed in the background, a turn only waits for its own
+transcriber = BackgroundTranscriber(transcribe_base64_audio, submit_turn)
+aggregator = MessageAggregator(transcriber.submit)
+
+# Inbound messages are journaled before being acknowledged. A shared aggregation
+# store already persists the buffers, so the local journal is only used in memory
+journal = (
+    MessageJournal()
+    if MESSAGE_JOURNAL_ENABLED and AGGREGATION_STORE == "memory"
+    else None
+)
+
+
+async def drain():
+    """
+    Stop taking messages, answer the buffered ones now and wait for the turns in
+    flight for up to AGENT_DRAIN_TIMEOUT seconds
+    """
+    app.state.draining = True
+    deadline = time.monotonic() + AGENT_DRAIN_TIMEOUT
+    # Windows still waiting for their voice notes at the deadline are unfinished
+    unflushed = await aggregator.flush_all(AGENT_DRAIN_TIMEOUT)
+
+    remaining = max(deadline - time.monotonic(), 0)
+    if agent_workers:
+        unfinished = await agent_workers.stop(remaining)
+    else:
+        unfinished = await conversations.drain(remaining)
+    for sender_id, (messages, context) in unflushed.items():
+        entries, sender_context = unfinished.setdefault(sender_id, ([], {}))
+        entries.extend(messages)
+        sender_context.update(context)
+    if not unfinished:
+        logger.info("All turns finished")
+        return
+
+    count = sum(len(messages) for messages, _ in unfinished.values())
+    if journal:
+        # Still unprocessed in the journal, the next instance replays them
+        logger.warning(f"{count} messages left in the journal for the next instance")
+    elif AGGREGATION_STORE != "memory":
+        for sender_id, (messages, context) in unfinished.items():
+            await aggregator.requeue(sender_id, messages, context)
+        logger.warning(f"{count} messages handed back to the aggregation store")
+    else:
+        logger.error(f"{count} messages dropped, enable MESSAGE_JOURNAL_ENABLED")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Handle startup and shutdown events."""
     logger.info("WebHook service starting up")
-    yield
-    logger.info("WebHook service shutting down")
+    app.state.draining = False
+    async with agent_resources() as pool:
+        await transcription.open()
+        if transcription_cache:
+            await transcription_cache.open()
+        aggregator.store = create_aggregation_store(pool)
+        await aggregator.store.setup()
+
+        if agent_workers:
+            await agent_workers.start()
+
+        background_tasks = [asyncio.create_task(aggregator.watch_expired())]
+        if journal:
+            # Replay the turns that never finished on the previous instance,
+            # without holding up startup while their voice notes are transcribed
+            unfinished = await journal.open()
+            for sender_id, (entries, context) in unfinished.items():
+                background_tasks.append(
+                    asyncio.create_task(
+                        transcriber.submit(sender_id, entries, context)
+                    )
+                )
+            if unfinished:
+                logger.info(f"Replaying unfinished turns of {len(unfinished)} senders")
+
+        if CHECKPOINT_PRUNE_INTERVAL > 0:
+            background_tasks.append(asyncio.create_task(run_retention_loop(pool)))
+        try:
+            yield
+        finally:
+            logger.info("WebHook service shutting down")
+            for task in background_tasks:
+                task.cancel()
+            await drain()
+            if journal:
+                await journal.close()
+            await transcription.close()
+            if transcription_cache:
+                await transcription_cache.close()
 
 
 app = FastAPI(title="WPPConnect Message Parser", lifespan=lifespan)
@@ -140,6 +291,10 @@ async def webhook_handler(data: Dict[str, Any]):
     request_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
     logger.info(f"Received webhook request - ID: {request_id}")
 
+    if app.state.draining:
+        # Shutting down: WPPConnect retries, and another instance takes it
+        raise HTTPException(status_code=503, detail="Service is shutting down")
+
     try:
         # Check if this is a message we want to process
         if (
@@ -151,28 +306,11 @@ async def webhook_handler(data: Dict[str, Any]):
             try:
                 message_text = data.get("body", "")
 
-                # Handle audio messages
-                if data.get("type") == "ptt":
-                    logger.info(f"Request {request_id} - Processing audio message")
-                    try:
-                        # Transcribe base64 audio data
-                        message_text = await transcribe_base64_audio(message_text)
-                        logger.info(
-                            f"Request {request_id} - Audio transcribed: {message_text}"
-                        )
-                    except Exception as e:
-                        logger.error(
-                            f"Request {request_id} - Error processing audio: {str(e)}"
-                        )
-                        raise HTTPException(
-                            status_code=422, detail=f"Error processing audio: {str(e)}"
-                        )
-
                 # Parse the message
                 message = WebhookMessage(
                     event=data["event"],
                     session=data["session"],
-                    body=message_text,  # Use transcribed text for audio messages
+                    body=message_text,  # base64 audio for voice messages
                     type=data["type"],
                     isNewMsg=data["isNewMsg"],
                     sender=Sender(
@@ -182,28 +320,43 @@ async def webhook_handler(data: Dict[str, Any]):
                 )
 
                 sender_id = message.sender.id
+                context = {
+                    "session": message.session,
+                    "is_user": message.sender.isUser,
+                    "is_group": message.isGroupMsg,
+                }
+
+                # Persist the message before acknowledging it
+                journal_id = None
+                if journal:
+                    journal_id = await journal.append(
+                        sender_id, message.body, message.type, context
+                    )
 
-                # Add message to buffer
-                message_buffers[sender_id].append(message.body)
-
-                # If this is the first message from this sender, create a new processing task
-                if sender_id not in processing_tasks:
-                    task = asyncio.create_task(
-                        process_aggregated_messages(
-                            sender_id,
-                            message.session,
-                            message.sender.isUser,
-                            message.isGroupMsg,
-                        )
+                entry = {
+                    "text": message.body,
+                    "journal_id": journal_id,
+                    "type": message.type,
+                }
+                if message.type == "ptt":
+                    # Buffer a placeholder and transcribe while the window is open
+                    logger.info(f"Request {request_id} - Transcribing audio message")
+                    entry.update(
+                        text=None,
+                        audio=message.body,
+                        placeholder=transcriber.start(message.body),
                     )
-                    processing_tasks[sender_id] = task
 
+                # Add message to the sender's aggregation window
+                opened = await aggregator.add(sender_id, entry, **context)
+
+                if opened:
                     return {
                         "status": "aggregating",
                         "message": "Message received and being aggregated",
                     }
                 else:
-                    # If we already have a task running, just acknowledge the message
+                    # If the window is already open, just acknowledge the message
                     return {
                         "status": "aggregating",
                         "message": "Message added to existing aggregation window",
@@ -233,4 +386,10 @@ async def webhook_handler(data: Dict[str, Any]):
 async def health_check():
     """Simple health check endpoint"""
     logger.info("Health check requested")
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Runtime statistics of the shared resources"""
+    return {"postgres_pool": get_pool_stats(app.state.pool), **metrics.snapshot()}
@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+from app.messaging.aggregator import MessageAggregator
+
+
+def test_flush_all_returns_windows_still_flushing_at_the_deadline():
+    handed_over = []
+
+    async def on_flush(sender_id, messages, context):
+        if sender_id == "voice":
+            # Waiting for a voice note that takes longer than the deadline
+            await asyncio.sleep(60)
+        handed_over.append(sender_id)
+
+    async def scenario():
+        aggregator = MessageAggregator(on_flush, wait_time=30)
+        await aggregator.add("text", {"text": "hello"}, session="s")
+        await aggregator.add("voice", {"text": None, "audio": "b64"}, session="s")
+        start = time.monotonic()
+        unflushed = await aggregator.flush_all(timeout=0.2)
+        return unflushed, time.monotonic() - start
+
+    unflushed, elapsed = asyncio.run(scenario())
+
+    assert elapsed < 1
+    assert handed_over == ["text"]
+    assert unflushed == {"voice": ([{"text": None, "audio": "b64"}], {"session": "s"})}
@@ -0,0 +1,26 @@
+import asyncio
+import sqlite3
+
+from app.messaging.journal import MessageJournal
+
+
+def test_processed_messages_are_purged_while_running(tmp_path):
+    path = str(tmp_path / "journal.db")
+
+    async def scenario():
+        journal = MessageJournal(path, retention=0.1, purge_interval=0)
+        await journal.open()
+        first = await journal.append("a", "hello", "chat", {})
+        second = await journal.append("b", "pending", "chat", {})
+        await journal.mark_processed([first])
+        await asyncio.sleep(0.2)
+        await journal.append("c", "later", "chat", {})
+        await journal.close()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    rows = sqlite3.connect(path).execute("SELECT id FROM inbound_messages")
+    ids = [id for id, in rows]
+    assert first not in ids
+    assert second in ids
@@ -0,0 +1,141 @@
+"""
+Tests of the Postgres aggregation store and turn lock.
+
+They need a database: set TEST_PSQL_CONNECTION_STRING (e.g. to a local
+container) to run them, otherwise they are skipped.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+
+import pytest
+
+from app.messaging.aggregator import MessageAggregator
+from app.messaging.conversation import PostgresTurnLock
+from app.messaging.store import PostgresAggregationStore
+from app.src.postgres.pool import create_lock_pool, create_pool
+
+TEST_PSQL_CONNECTION_STRING = os.getenv("TEST_PSQL_CONNECTION_STRING")
+
+pytestmark = pytest.mark.skipif(
+    not TEST_PSQL_CONNECTION_STRING, reason="TEST_PSQL_CONNECTION_STRING is not set"
+)
+
+
+@pytest.fixture(autouse=True)
+def connection_string(monkeypatch):
+    monkeypatch.setenv("PSQL_CONNECTION_STRING", TEST_PSQL_CONNECTION_STRING)
+
+
+def run_with_store(scenario):
+    """Run ``scenario(store, sender_id)`` on a fresh sender of the shared table."""
+
+    async def main():
+        pool = create_pool()
+        await pool.open(wait=True)
+        store = PostgresAggregationStore(pool)
+        await store.setup()
+        sender_id = f"test-{uuid.uuid4()}"
+        try:
+            return await scenario(store, sender_id)
+        finally:
+            async with pool.connection() as conn:
+                await conn.execute(
+                    "DELETE FROM aggregation_windows WHERE sender_id = %s",
+                    (sender_id,),
+                )
+            await pool.close()
+
+    return asyncio.run(main())
+
+
+def test_only_the_append_that_opens_the_window_claims_it():
+    async def scenario(store, sender_id):
+        lease_until = time.time() + 30
+        first = await store.append(sender_id, {"text": "a"}, {}, "w1", lease_until)
+        second = await store.append(sender_id, {"text": "b"}, {}, "w2", lease_until + 1)
+        own_again = await store.append(
+            sender_id, {"text": "c"}, {}, "w1", lease_until + 2
+        )
+        flushed = await store.close(sender_id, "w1")
+        return first, second, own_again, flushed
+
+    first, second, own_again, flushed = run_with_store(scenario)
+
+    assert first is True
+    assert second is False
+    assert own_again is False
+    assert flushed[0] == [{"text": "a"}, {"text": "b"}, {"text": "c"}]
+
+
+def test_an_expired_owner_is_taken_over():
+    async def scenario(store, sender_id):
+        await store.append(sender_id, {"text": "a"}, {}, "gone", time.time() - 1)
+        claimed = await store.append(
+            sender_id, {"text": "b"}, {}, "w2", time.time() + 30
+        )
+        old_owner = await store.renew(sender_id, "gone", time.time() + 30)
+        new_owner = await store.renew(sender_id, "w2", time.time() + 30)
+        not_closed = await store.close(sender_id, "gone")
+        flushed = await store.close(sender_id, "w2")
+        return claimed, old_owner, new_owner, not_closed, flushed
+
+    claimed, old_owner, new_owner, not_closed, flushed = run_with_store(scenario)
+
+    assert claimed is True
+    assert old_owner is None
+    assert new_owner is not None and new_owner.owner == "w2"
+    assert not_closed is None
+    assert flushed == ([{"text": "a"}, {"text": "b"}], {})
+
+
+def test_requeued_turn_is_claimed_by_another_worker():
+    async def scenario(store, sender_id):
+        stopping = MessageAggregator(None, store=store)
+        await stopping.requeue(
+            sender_id, [{"text": "a"}, {"text": "b"}], {"session": "s"}
+        )
+        claimed = await store.claim_expired("w2", time.time() + 30)
+        window = await store.renew(sender_id, "w2", time.time() + 30)
+        flushed = await store.close(sender_id, "w2")
+        return sender_id in claimed, window, flushed
+
+    claimed, window, flushed = run_with_store(scenario)
+
+    assert claimed
+    assert window.flush_now is True
+    assert flushed == ([{"text": "a"}, {"text": "b"}], {"session": "s"})
+
+
+def test_turn_lock_serializes_a_conversation_across_pools():
+    events = []
+
+    async def turn(lock, thread_id, name, duration, delay=0):
+        await asyncio.sleep(delay)
+        async with lock.hold(thread_id):
+            events.append(f"{name} start")
+            await asyncio.sleep(duration)
+            events.append(f"{name} end")
+
+    async def scenario():
+        # Two locks on their own pools, like two workers
+        first, second = (PostgresTurnLock(create_lock_pool(2)) for _ in range(2))
+        await first.open()
+        await second.open()
+        thread_id = f"test-{uuid.uuid4()}"
+        try:
+            await asyncio.gather(
+                turn(first, thread_id, "a", 0.3),
+                turn(second, thread_id, "b", 0, delay=0.1),
+                turn(second, f"{thread_id}-other", "c", 0, delay=0.1),
+            )
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(scenario())
+
+    assert events.index("a end") < events.index("b start")
+    assert events.index("c end") < events.index("a end")
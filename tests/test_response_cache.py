@@ -0,0 +1,50 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from app.agent import Assistant
+from app.utils.response_cache import ResponseCache
+
+
+def test_only_trivial_messages_are_cacheable():
+    cache = ResponseCache()
+    assert cache.key("Thanks!!", "f") == "f:thanks"
+    assert cache.key("👍", "f") == "f:👍"
+    assert cache.key("🙏🏽", "f") is not None
+    for message in ("i want to die", "help me", "not ok", "no", "why?", ":("):
+        assert cache.key(message, "f") is None, message
+
+
+def assistant(replies: list) -> Assistant:
+    def reply(inputs):
+        replies.append(inputs["messages"][-1].content)
+        return AIMessage(content=f"reply {len(replies)}")
+
+    return Assistant(RunnableLambda(reply), response_cache=ResponseCache())
+
+
+def turn(node: Assistant, thread_id: str, messages: list) -> str:
+    state = {"messages": messages, "summary": None}
+    config = {"configurable": {"thread_id": thread_id}}
+    return asyncio.run(node(state, config))["messages"].content
+
+
+def test_greeting_opening_a_conversation_is_shared():
+    calls = []
+    node = assistant(calls)
+    first = turn(node, "a", [HumanMessage(content="Hi", id="1")])
+    assert turn(node, "b", [HumanMessage(content="hi!", id="2")]) == first
+    assert len(calls) == 1
+
+
+def test_mid_conversation_replies_are_not_cached():
+    calls = []
+    node = assistant(calls)
+    history = [
+        HumanMessage(content="hi", id="1"),
+        AIMessage(content="Hello! How are you?", id="2"),
+    ]
+    turn(node, "a", history + [HumanMessage(content="ok", id="3")])
+    turn(node, "a", history + [HumanMessage(content="ok", id="4")])
+    assert len(calls) == 2
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from app.config.config import register_provider, setup_model
+
+
+class FailingChatModel(FakeListChatModel):
+    """Stub model whose calls always fail."""
+
+    def _call(self, *args, **kwargs):
+        raise RuntimeError("provider down")
+
+
+register_provider("failing", lambda llm_config: FailingChatModel(responses=[""]))
+
+
+def router(*providers):
+    """Route between ``providers``: provider names, or stub replies."""
+    return setup_model(
+        {
+            "temperature": 0,
+            "providers": [
+                {"provider": "failing", "model": name}
+                if name.startswith("failing")
+                else {"provider": "stub", "model": name, "responses": [name]}
+                for name in providers
+            ],
+        }
+    )
+
+
+def ask(model) -> str:
+    return asyncio.run(model.ainvoke("hello")).content
+
+
+def test_a_failed_call_fails_over_to_the_next_provider():
+    model = router("failing", "backup")
+
+    assert ask(model) == "backup"
+    assert model.stats["failing:failing"].error_rate == 1.0
+    assert model.stats["stub:backup"].sampled
+
+
+def test_providers_are_ranked_by_latency():
+    model = router("slow", "fast")
+    model.stats["stub:slow"].record_success(2.0)
+    model.stats["stub:fast"].record_success(0.5)
+
+    assert model.ranked_providers() == ["stub:fast", "stub:slow"]
+    assert ask(model) == "fast"
+
+
+def test_unsampled_providers_come_after_the_sampled_ones():
+    model = router("primary", "fallback")
+
+    assert ask(model) == "primary"
+    # The fallback was never tried, its latency of 0.0 is not a measurement
+    assert model.ranked_providers() == ["stub:primary", "stub:fallback"]
+
+
+def test_failing_provider_cools_down_then_comes_back():
+    model = router("failing", "backup")
+    model.cooldown = 0.2
+    # It used to be the fastest provider, until it went down
+    model.stats["failing:failing"].record_success(0.01)
+    model.stats["stub:backup"].record_success(1.0)
+    for _ in range(3):
+        assert ask(model) == "backup"
+
+    assert not model.stats["failing:failing"].is_healthy()
+    assert model.ranked_providers()[-1] == "failing:failing"
+
+    time.sleep(0.3)
+    assert model.stats["failing:failing"].is_healthy()
@@ -0,0 +1,82 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langgraph.checkpoint.memory import MemorySaver
+
+import app.agent as agent
+import app.utils.streaming as streaming
+from app.agent import ERROR_REPLY, FALLBACK_REPLY, GraphCache
+from app.config.config import register_provider
+from app.utils.streaming import SentenceSplitter
+
+
+def test_splitter_reset_drops_the_unfinished_sentence():
+    splitter = SentenceSplitter(min_chars=10)
+    assert splitter.feed("A complete sentence here. Half of a") == [
+        "A complete sentence here."
+    ]
+    splitter.reset()
+    assert splitter.feed("Sorry, try again.") == []
+    assert splitter.flush() == "Sorry, try again."
+
+
+def stream_turn(monkeypatch, providers, deadline=30):
+    """Run a streamed turn on ``providers`` and return the messages sent."""
+    sent = []
+    monkeypatch.setattr(streaming, "send_reply", lambda text, *_: sent.append(text))
+    monkeypatch.setattr(agent, "send_message", lambda text, *_: sent.append(text))
+    monkeypatch.setattr(agent, "STREAM_REPLIES", True)
+    monkeypatch.setattr(agent, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setenv("LLM_TURN_DEADLINE", str(deadline))
+    llm_config = {"temperature": 0, "providers": providers}
+    monkeypatch.setattr(agent, "graph_cache", GraphCache(llm_config, "prompt"))
+
+    asyncio.run(agent.main("123", "hello", MemorySaver(), text_only=True))
+    return sent
+
+
+def test_deadline_does_not_cut_an_answer_already_streaming(monkeypatch):
+    reply = (
+        "This first sentence is long enough to be sent. "
+        "This second one is long enough to go out and outlasts the deadline."
+    )
+    sent = stream_turn(
+        monkeypatch,
+        [{"provider": "stub", "model": "stub", "responses": [reply], "sleep": 0.005}],
+        deadline=0.3,
+    )
+
+    assert sent == [
+        "This first sentence is long enough to be sent.",
+        "This second one is long enough to go out and outlasts the deadline.",
+    ]
+    assert FALLBACK_REPLY not in sent
+
+
+def test_deadline_fallback_when_nothing_was_streamed(monkeypatch):
+    sent = stream_turn(
+        monkeypatch,
+        [{"provider": "stub", "model": "stub", "responses": ["Too late."], "sleep": 1}],
+        deadline=0.3,
+    )
+
+    assert " ".join(sent) == FALLBACK_REPLY
+
+
+def test_provider_failing_mid_stream_is_not_followed_by_another_answer(monkeypatch):
+    register_provider(
+        "broken",
+        lambda llm_config: FakeListChatModel(
+            responses=["The broken provider answers this first sentence. Then it"],
+            error_on_chunk_number=55,
+        ),
+    )
+    sent = stream_turn(
+        monkeypatch,
+        [
+            {"provider": "broken", "model": "broken"},
+            {"provider": "stub", "model": "stub", "responses": ["A second answer."]},
+        ],
+    )
+
+    assert sent == ["The broken provider answers this first sentence.", ERROR_REPLY]
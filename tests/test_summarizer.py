@@ -0,0 +1,64 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+from langgraph.checkpoint.memory import MemorySaver
+
+import app.agent as agent
+import app.utils.graph_utils as graph_utils
+from app.agent import GraphCache, Summarizer
+from app.utils.graph_utils import process_chunks
+
+
+def history(turns: int) -> list:
+    messages = []
+    for i in range(turns):
+        messages.append(HumanMessage(content=f"question {i}", id=f"h{i}"))
+        messages.append(AIMessage(content=f"answer {i}", id=f"a{i}"))
+    return messages
+
+
+def failing_runnable():
+    def fail(_):
+        raise RuntimeError("summary model down")
+
+    return RunnableLambda(fail)
+
+
+def test_summarizer_leaves_history_when_model_fails():
+    summarizer = Summarizer(failing_runnable(), keep_messages=2)
+    state = {"messages": history(4), "summary": None}
+    assert asyncio.run(summarizer(state, {})) is None
+
+
+def test_summarizer_leaves_history_when_nothing_to_fold():
+    summarizer = Summarizer(failing_runnable(), keep_messages=6)
+    state = {"messages": history(1), "summary": None}
+    assert asyncio.run(summarizer(state, {})) is None
+
+
+def test_process_chunks_ignores_empty_updates(monkeypatch):
+    sent = []
+    monkeypatch.setattr(graph_utils, "send_message", lambda text, _: sent.append(text))
+    process_chunks({"summarize": None}, "123", text_only=True)
+    process_chunks({"assistant": {"messages": AIMessage(content="Hi.")}}, "123", True)
+    assert sent == ["Hi."]
+
+
+def test_turn_with_idle_summarizer_sends_only_the_reply(monkeypatch):
+    sent = []
+    monkeypatch.setattr(graph_utils, "send_message", lambda text, _: sent.append(text))
+    monkeypatch.setattr(agent, "send_message", lambda text, _: sent.append(text))
+    # Route every turn to the summarizer, which has nothing old enough to fold
+    monkeypatch.setattr(agent, "SUMMARY_MAX_MESSAGES", 0)
+    monkeypatch.setattr(agent, "STREAM_REPLIES", False)
+    monkeypatch.setattr(agent, "RESPONSE_CACHE_ENABLED", False)
+    llm_config = {
+        "temperature": 0,
+        "providers": [{"provider": "stub", "model": "stub", "responses": ["Reply."]}],
+    }
+    monkeypatch.setattr(agent, "graph_cache", GraphCache(llm_config, "prompt"))
+
+    asyncio.run(agent.main("123", "hello", MemorySaver(), text_only=True))
+
+    assert sent == ["Reply."]
@@ -0,0 +1,75 @@
+import asyncio
+
+from app.src.transcription.backends import StubBackend, register_backend
+from app.src.transcription.cache import TranscriptionCache, audio_key
+from app.src.transcription.client import TranscriptionClient
+
+calls = []
+
+
+class CountingBackend(StubBackend):
+    def __init__(self):
+        super().__init__(delay=0.2, max_concurrent=1)
+
+    async def _transcribe(self, audio, language):
+        calls.append((self.name, audio))
+        return await super()._transcribe(audio, language)
+
+
+class PrimaryBackend(CountingBackend):
+    name = "primary"
+
+
+class SpareBackend(CountingBackend):
+    name = "spare"
+
+
+register_backend("primary", PrimaryBackend)
+register_backend("spare", SpareBackend)
+
+
+def test_cache_key_does_not_depend_on_the_routed_backend():
+    async def scenario():
+        client = TranscriptionClient("default:primary", fallback="spare")
+        cache = TranscriptionCache(path="")
+        await client.open()
+
+        async def transcribe(audio):
+            key = audio_key(audio, None, client.model)
+            return await cache.fetch(key, lambda: client.transcribe(audio))
+
+        # The primary is busy, so the note overflows to the spare backend
+        busy = asyncio.create_task(transcribe(b"other note"))
+        await asyncio.sleep(0.05)
+        first = await transcribe(b"forwarded note")
+        await busy
+        # The primary is free again: the same note is still a cache hit
+        second = await transcribe(b"forwarded note")
+        await client.close()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert first == second
+    assert calls == [("primary", b"other note"), ("spare", b"forwarded note")]
+
+
+def test_disk_tier_keeps_only_its_most_recent_entries(tmp_path):
+    path = str(tmp_path / "transcriptions.db")
+
+    async def scenario():
+        cache = TranscriptionCache(path=path, disk_max_entries=3, prune_interval=0)
+        await cache.open()
+        for index in range(5):
+            await cache.set(f"note-{index}", f"text {index}")
+        await cache.close()
+
+        reopened = TranscriptionCache(path=path)
+        await reopened.open()
+        kept = [await reopened.get(f"note-{index}") for index in range(5)]
+        await reopened.close()
+        return kept
+
+    kept = asyncio.run(scenario())
+
+    assert kept == [None, None, "text 2", "text 3", "text 4"]
@@ -0,0 +1,118 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from app.messaging.workers import AgentWorkerPool
+
+
+@asynccontextmanager
+async def no_resources():
+    yield
+
+
+async def crash_once(sender_id, messages, context):
+    """Kill the worker the first time it runs a turn of ``crash``."""
+    marker = context["marker"]
+    if sender_id == "crash" and not os.path.exists(marker):
+        open(marker, "w").close()
+        os._exit(1)
+    await asyncio.sleep(0.01)
+
+
+def test_turns_of_a_dead_worker_are_dispatched_again(tmp_path):
+    done = []
+
+    async def on_done(sender_id, messages):
+        done.append((sender_id, [m["text"] for m in messages]))
+
+    async def scenario():
+        pool = AgentWorkerPool(
+            1, no_resources, crash_once, on_done, check_interval=0.2
+        )
+        await pool.start()
+        context = {"marker": str(tmp_path / "crashed")}
+        await pool.submit("crash", [{"text": "first"}], context)
+        await pool.submit("other", [{"text": "queued"}], context)
+        for _ in range(200):
+            if len(done) == 2:
+                break
+            await asyncio.sleep(0.1)
+        return await pool.stop(timeout=5)
+
+    unfinished = asyncio.run(scenario())
+
+    assert sorted(done) == [("crash", ["first"]), ("other", ["queued"])]
+    assert unfinished == {}
+
+
+async def crash_on_poison(sender_id, messages, context):
+    if sender_id == "poison":
+        os._exit(1)
+    await asyncio.sleep(0.01)
+
+
+def test_a_turn_that_keeps_killing_its_worker_is_given_up():
+    done, abandoned = [], []
+
+    async def on_done(sender_id, messages):
+        done.append(sender_id)
+
+    async def on_abandoned(sender_id, messages):
+        abandoned.append((sender_id, [m["text"] for m in messages]))
+
+    async def scenario():
+        pool = AgentWorkerPool(
+            1,
+            no_resources,
+            crash_on_poison,
+            on_done,
+            check_interval=0.2,
+            max_turn_deaths=2,
+            on_abandoned=on_abandoned,
+        )
+        await pool.start()
+        await pool.submit("poison", [{"text": "boom"}], {})
+        await pool.submit("innocent", [{"text": "hi"}], {})
+        for _ in range(200):
+            if done and abandoned:
+                break
+            await asyncio.sleep(0.1)
+        return await pool.stop(timeout=5)
+
+    unfinished = asyncio.run(scenario())
+
+    assert abandoned == [("poison", ["boom"])]
+    assert done == ["innocent"]
+    assert unfinished == {}
+
+
+async def slow_or_failing(sender_id, messages, context):
+    if sender_id == "fail":
+        raise RuntimeError("turn failed")
+    await asyncio.sleep(5 if sender_id == "slow" else 0.01)
+
+
+def test_stop_reports_only_the_turns_that_did_not_finish():
+    done = []
+
+    async def on_done(sender_id, messages):
+        done.append(sender_id)
+
+    async def scenario():
+        pool = AgentWorkerPool(
+            1, no_resources, slow_or_failing, on_done, check_interval=60
+        )
+        await pool.start()
+        await pool.submit("fail", [{"text": "lost"}], {})
+        await pool.submit("slow", [{"text": "a"}], {})
+        await pool.submit("fast", [{"text": "b"}], {})
+        for _ in range(200):
+            if done:
+                break
+            await asyncio.sleep(0.1)
+        return await pool.stop(timeout=0.5)
+
+    unfinished = asyncio.run(scenario())
+
+    assert done == ["fast"]
+    assert unfinished == {"slow": ([{"text": "a"}], {})}